@@ -1,15 +1,32 @@
 import os
 import logging
 from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.orm import DeclarativeBase
 
 # Enable debug logging
 logging.basicConfig(level=logging.DEBUG)
 
+class Base(DeclarativeBase):
+    pass
+
+db = SQLAlchemy(model_class=Base)
+
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key-12345")
 
-# Import routes after app creation to avoid circular imports
+# Postgres in production via DATABASE_URL; a local SQLite file (under instance/) otherwise
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///predictions.db")
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_recycle": 300,
+    "pool_pre_ping": True,
+}
+db.init_app(app)
+
+# Import routes after app creation to avoid circular imports. The only table,
+# the prediction history, is created by its writer thread when history is
+# enabled, so booting never needs the database.
 from routes import *
 
 if __name__ == '__main__':
@@ -0,0 +1,233 @@
+import logging
+import queue
+import threading
+import time
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = Histogram('microbatch_size', "Requests scored together per micro-batch",
+                       buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256))
+QUEUE_SECONDS = Histogram('microbatch_queue_seconds', "Time a request waited before its batch was scored")
+BATCHES = Counter('microbatch_batches_total', "Micro-batches scored")
+
+# Sentinel telling a worker thread to exit once everything before it is handled
+_STOP = object()
+
+
+class BatchWorker:
+    """A background thread that drains a queue in batches
+
+    Each batch starts with the oldest queued item and takes whatever else is
+    queued, waiting up to max_wait seconds for more while wait_for_more(n)
+    (n = items so far) says it is worth it, until max_batch_size items. The
+    batch is then passed to handle_batch, which is expected to deal with
+    its own errors. max_queue bounds the queue (0 for unbounded).
+    """
+
+    def __init__(self, handle_batch, name, max_batch_size, max_wait, max_queue=0, wait_for_more=None,
+                 start=True):
+        self.handle_batch = handle_batch
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self.wait_for_more = wait_for_more or (lambda n: True)
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        if start:
+            self.start()
+
+    def start(self):
+        """Start the thread with a fresh queue
+
+        Construct with start=False in a process that is going to fork (a
+        preloading gunicorn master) and call this in each worker instead.
+        """
+        self._queue = queue.Queue(self.max_queue)
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def put(self, item, timeout=None):
+        """Queue an item, waiting at most timeout seconds (0: not at all) for room
+
+        Raises queue.Full when the queue stays full.
+        """
+        if timeout == 0:
+            self._queue.put_nowait(item)
+        else:
+            self._queue.put(item, timeout=timeout)
+
+    def close(self, timeout=None):
+        """Handle everything already queued and stop the thread
+
+        Waits at most timeout seconds in all (None: until done). Items still
+        queued when it gives up are taken off the queue, so the thread never
+        handles them, and their number is returned; 0 when the thread finished.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return self._discard()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return self._discard()
+        self._thread.join(None if deadline is None else max(deadline - time.monotonic(), 0))
+        return self._discard() if self._thread.is_alive() else 0
+
+    def _discard(self):
+        """Empty the queue, returning how many items were in it
+
+        A running thread is left a stop sentinel to exit on once it gets
+        through its current batch.
+        """
+        discarded = 0
+        while True:
+            try:
+                discarded += self._queue.get_nowait() is not _STOP
+            except queue.Empty:
+                break
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put_nowait(_STOP)
+        return discarded
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def _collect(self, first):
+        """Gather a batch starting with `first`; returns (batch, stop requested)"""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self.wait_for_more(len(batch)):
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect(first)
+            try:
+                self.handle_batch(batch)
+            except Exception as e:
+                logger.exception(f"Error in {self.name} handling a batch of {len(batch)}: {e}")
+            if stop:
+                return
+
+
+class _Pending:
+    """One request waiting for its prediction"""
+
+    __slots__ = ('symptoms', 'enqueued', 'done', 'result', 'bundle', 'error')
+
+    def __init__(self, symptoms):
+        self.symptoms = symptoms
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        # The model bundle the batch was scored with
+        self.bundle = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent predict_disease calls into one batched scoring call
+
+    Request threads enqueue their symptoms and block. A dispatcher thread
+    takes everything queued, waits up to max_wait_ms for more only while
+    other requests are still on their way in, and scores the batch with a
+    single predictor.predict_cached call. A lone request is therefore never
+    delayed by the window.
+    """
+
+    def __init__(self, predictor, max_batch_size=64, max_wait_ms=2.0, start=True):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.requests = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._worker = BatchWorker(self._score, 'micro-batcher', max_batch_size, self.max_wait,
+                                   wait_for_more=lambda n: self._in_flight > n, start=start)
+
+    def start(self):
+        """Start the dispatcher thread (see BatchWorker.start)"""
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._worker.start()
+
+    def predict(self, selected_symptoms, timeout=None, return_bundle=False):
+        """Predict one symptom list; blocks until its batch has been scored
+        
+        With return_bundle, returns (prediction, bundle) like predictor.predict_disease.
+        """
+        pending = _Pending(selected_symptoms)
+        with self._lock:
+            self._in_flight += 1
+        try:
+            self._worker.put(pending)
+            if not pending.done.wait(timeout):
+                raise TimeoutError("Timed out waiting for a micro-batch")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        if pending.error is not None:
+            raise pending.error
+        return (pending.result, pending.bundle) if return_bundle else pending.result
+
+    def close(self):
+        """Stop the dispatcher after it has scored everything already queued"""
+        self._worker.close()
+
+    def queue_depth(self):
+        return self._worker.queue_depth()
+
+    def stats(self):
+        """Queue depth, in-flight requests and batching counters"""
+        return {
+            'queue_depth': self.queue_depth(),
+            'in_flight': self._in_flight,
+            'batches': self.batches,
+            'requests': self.requests,
+            'mean_batch_size': self.requests / self.batches if self.batches else 0.0,
+        }
+
+    def _score(self, batch):
+        start = time.perf_counter()
+        for pending in batch:
+            QUEUE_SECONDS.observe(start - pending.enqueued)
+        try:
+            results, bundle = self.predictor.predict_cached([pending.symptoms for pending in batch],
+                                                            return_bundle=True)
+        except Exception as e:
+            logger.exception(f"Error scoring a micro-batch of {len(batch)}: {e}")
+            results = bundle = None
+
+        for i, pending in enumerate(batch):
+            if results is None:
+                pending.error = RuntimeError("Micro-batch scoring failed")
+            else:
+                pending.result = results[i]
+                pending.bundle = bundle
+            pending.done.set()
+
+        self.batches += 1
+        self.requests += len(batch)
+        BATCHES.inc()
+        BATCH_SIZE.observe(len(batch))
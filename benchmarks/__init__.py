@@ -0,0 +1,15 @@
+"""Performance benchmarks for inference, HTTP serving, data generation, training and
+worker memory.
+
+Run everything and save the results:
+
+    python -m benchmarks run --output bench.json
+
+Fail (exit code 1) when a metric regressed by more than 10% against a baseline:
+
+    python -m benchmarks compare bench.json --baseline baseline.json --threshold 0.10
+
+Pick an operating point for the early-exit model cascade:
+
+    python -m benchmarks cascade --metric margin --thresholds 0.3 0.5 0.7
+"""
@@ -0,0 +1,83 @@
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks import compare
+
+SUITES = ('inference', 'http', 'data', 'training', 'memory')
+
+
+def run_suites(names):
+    # Imported lazily so that `compare` works without the ML dependencies
+    from benchmarks import data, inference, memory, serving, training
+    runners = {'inference': inference.run, 'http': serving.run, 'data': data.run, 'training': training.run,
+               'memory': memory.run}
+
+    metrics = {}
+    for name in names:
+        start = time.perf_counter()
+        print(f"Running {name} benchmarks...", file=sys.stderr)
+        metrics.update(runners[name]())
+        print(f"  done in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+    return metrics
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Disease predictor benchmarks")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help="run benchmarks and write results as JSON")
+    run.add_argument('--output', default='bench.json')
+    run.add_argument('--only', nargs='+', choices=SUITES, default=list(SUITES))
+    run.add_argument('--baseline', help="also compare against this results file")
+    run.add_argument('--threshold', type=float, default=0.10)
+
+    check = commands.add_parser('compare', help="compare a results file against a baseline")
+    check.add_argument('results')
+    check.add_argument('--baseline', required=True)
+    check.add_argument('--threshold', type=float, default=0.10,
+                       help="relative change that counts as a regression (default 0.10)")
+
+    cascade = commands.add_parser('cascade', help="accuracy vs latency of the model cascade per threshold")
+    cascade.add_argument('--thresholds', nargs='+', type=float)
+    cascade.add_argument('--metric', choices=('confidence', 'margin'), default='confidence')
+    cascade.add_argument('--samples', type=int, default=5000)
+    cascade.add_argument('--output', help="also write the rows as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == 'cascade':
+        from benchmarks import cascade as cascade_eval
+        rows = cascade_eval.evaluate(args.thresholds or cascade_eval.THRESHOLDS, args.metric, args.samples)
+        cascade_eval.print_evaluation(rows, args.metric)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(rows, f, indent=2)
+        return 0
+
+    if args.command == 'run':
+        results = {
+            'meta': {
+                'created': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'suites': args.only,
+            },
+            'metrics': run_suites(args.only),
+        }
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote {len(results['metrics'])} metrics to {args.output}", file=sys.stderr)
+        if not args.baseline:
+            return 0
+    else:
+        results = compare.load_results(args.results)
+
+    rows = compare.compare(results, compare.load_results(args.baseline), args.threshold)
+    return 1 if compare.print_comparison(rows, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
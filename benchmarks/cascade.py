@@ -0,0 +1,51 @@
+"""Accuracy versus mean latency of the model cascade across thresholds"""
+import numpy as np
+
+from benchmarks.timing import time_calls
+from data_generator import DISEASES, generate_training_arrays
+from disease_predictor import CONFIDENCE, ENSEMBLE_STAGE, DiseasePredictor
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+
+def evaluate(thresholds=THRESHOLDS, metric=CONFIDENCE, n_samples=5000, latency_samples=500, seed=2024):
+    """One row per operating point, starting with the full ensemble
+
+    Accuracy is measured on a fresh synthetic holdout; latency is the mean
+    time to score a single request, which is what the cascade shortens.
+    """
+    predictor = DiseasePredictor(cache_size=0, use_prediction_table=False, cascade_metric=metric)
+    if not predictor.is_ready():
+        raise RuntimeError("No trained models available; run 'python data_generator.py' first")
+
+    X, y = generate_training_arrays(n_samples, seed)
+    X = X.astype(np.float64)
+    truth = np.asarray(DISEASES, dtype=object)[y]
+    # The last model never answers alone: rows reaching it go to the vote
+    stage_names = predictor.cascade[:-1] + [ENSEMBLE_STAGE]
+
+    rows = []
+    for threshold in (None, *thresholds):
+        predictor.cascade_threshold = threshold
+        diseases, _, stages = predictor.predict_arrays(X, return_stages=True)
+
+        singles = iter(X[:latency_samples][:, None, :])
+        samples = time_calls(lambda: predictor.predict_arrays(next(singles)),
+                             latency_samples - 20, warmup=20)
+        rows.append({
+            'threshold': threshold,
+            'accuracy': float((diseases == truth).mean()),
+            'mean_latency_us': float(samples.mean() * 1e6),
+            'stages': {name: float((stages == name).mean()) for name in stage_names},
+        })
+    return rows
+
+
+def print_evaluation(rows, metric=CONFIDENCE):
+    stage_names = list(rows[0]['stages'])
+    print(f"{metric + ' threshold':<22} {'accuracy':>9} {'mean latency':>13}  "
+          + "  ".join(f"{name:>{max(len(name), 6)}}" for name in stage_names))
+    for row in rows:
+        label = 'full ensemble' if row['threshold'] is None else f"{row['threshold']:g}"
+        shares = "  ".join(f"{row['stages'][name]:>{max(len(name), 6)}.1%}" for name in stage_names)
+        print(f"{label:<22} {row['accuracy']:>9.3f} {row['mean_latency_us']:>11.0f}us  {shares}")
@@ -0,0 +1,36 @@
+import json
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baseline, threshold=0.10):
+    """Compare metrics present in both runs
+
+    Returns a list of (name, baseline value, new value, relative change,
+    regressed) tuples. A metric regresses when it moved in its `better`
+    direction's opposite by more than `threshold` (0.10 = 10%).
+    """
+    rows = []
+    for name, new in sorted(results['metrics'].items()):
+        old = baseline['metrics'].get(name)
+        if old is None or old['value'] == 0:
+            continue
+
+        change = (new['value'] - old['value']) / abs(old['value'])
+        worse = change if new.get('better', 'lower') == 'lower' else -change
+        rows.append((name, old['value'], new['value'], change, worse > threshold))
+    return rows
+
+
+def print_comparison(rows, threshold):
+    print(f"{'metric':<48} {'baseline':>12} {'current':>12} {'change':>8}")
+    for name, old, new, change, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<48} {old:>12.4g} {new:>12.4g} {change:>+8.1%}{flag}")
+
+    regressions = sum(regressed for *_, regressed in rows)
+    print(f"{regressions} of {len(rows)} metrics regressed by more than {threshold:.0%}")
+    return regressions
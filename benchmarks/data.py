@@ -0,0 +1,24 @@
+import time
+
+from benchmarks.timing import throughput
+from data_generator import generate_training_data, iter_training_chunks
+
+SIZES = (2_000, 1_000_000)
+
+
+def run():
+    """Rows/sec of generate_training_data and of the chunked array generator"""
+    metrics = {}
+    for n_samples in SIZES:
+        start = time.perf_counter()
+        generate_training_data(n_samples, seed=0)
+        seconds = time.perf_counter() - start
+        metrics[f"data.generate_{n_samples}.rows_per_sec"] = throughput(n_samples / seconds, 'rows/s')
+
+    n_samples = 4_000_000
+    start = time.perf_counter()
+    for _ in iter_training_chunks(n_samples, seed=0):
+        pass
+    seconds = time.perf_counter() - start
+    metrics["data.chunks.rows_per_sec"] = throughput(n_samples / seconds, 'rows/s')
+    return metrics
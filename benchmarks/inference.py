@@ -0,0 +1,35 @@
+import random
+
+from benchmarks.timing import latency_metrics, throughput, time_calls
+from disease_predictor import DiseasePredictor
+
+BATCH_SIZES = (1, 100, 10_000)
+
+
+def random_records(symptoms, n, seed=0):
+    """n random symptom lists of 1-6 symptoms each"""
+    rng = random.Random(seed)
+    return [rng.sample(symptoms, rng.randint(1, min(6, len(symptoms)))) for _ in range(n)]
+
+
+def run(repeat=2000):
+    """Latency of predict_disease and predict_many, with caches disabled"""
+    # Caches would turn this into a lookup benchmark; measure the models themselves
+    predictor = DiseasePredictor(cache_size=0, use_prediction_table=False)
+    if not predictor.is_ready():
+        raise RuntimeError("No trained models available; run 'python data_generator.py' first")
+
+    metrics = {}
+    records = random_records(predictor.symptoms, repeat)
+    calls = iter(records * 2)
+    samples = time_calls(lambda: predictor.predict_disease(next(calls)), repeat, warmup=min(repeat, 50))
+    metrics.update(latency_metrics('inference.single', samples))
+
+    for batch_size in BATCH_SIZES:
+        batch = random_records(predictor.symptoms, batch_size, seed=batch_size)
+        batch_repeat = max(5, min(200, 20_000 // batch_size))
+        samples = time_calls(lambda: predictor.predict_many(batch), batch_repeat, warmup=2)
+        metrics.update(latency_metrics(f"inference.batch_{batch_size}", samples, 1e3, 'ms'))
+        metrics[f"inference.batch_{batch_size}.rows_per_sec"] = throughput(batch_size / samples.mean(), 'rows/s')
+
+    return metrics
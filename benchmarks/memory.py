@@ -0,0 +1,99 @@
+import os
+import shutil
+import subprocess
+import sys
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+from benchmarks.inference import random_records
+from benchmarks.serving import REPO_ROOT, _free_port, _wait_until_ready
+from benchmarks.timing import metric
+
+MODES = {'private': '0', 'preload': '1'}
+
+
+def _children(pid):
+    """Pids of the direct children of pid"""
+    children = []
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    # The command name may contain spaces; ppid is the second field after it
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            if ppid == pid:
+                children.append(int(name))
+    return children
+
+
+def process_memory_mb(pid):
+    """RSS, PSS and USS (private pages) of a process in MB, from smaps_rollup
+
+    RSS counts shared pages in full for every process; PSS splits them
+    between the processes sharing them, so summing PSS gives real usage.
+    """
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss': fields['Rss'], 'pss': fields['Pss'],
+            'uss': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+def measure(workers=4, preload=True, requests=200):
+    """Memory of the gunicorn master and each worker after serving some traffic"""
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PREDICTOR_STARTUP='eager', GUNICORN_PRELOAD=MODES['preload' if preload else 'private'])
+    server = subprocess.Popen(
+        ['gunicorn', '--workers', str(workers), '--bind', f"127.0.0.1:{port}", 'main:app'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        if not _wait_until_ready(f"{base_url}/healthz", timeout=60):
+            raise RuntimeError("gunicorn did not become ready within 60s")
+
+        # Let the workers touch the model arrays on the prediction path
+        symptoms = ['fever', 'cough', 'headache', 'fatigue', 'nausea', 'sore_throat', 'runny_nose', 'dizziness']
+        for record in random_records(symptoms, requests):
+            body = urllib.parse.urlencode({'symptoms': record}, doseq=True).encode()
+            with urllib.request.urlopen(f"{base_url}/predict", data=body) as response:
+                response.read()
+
+        worker_pids = _children(server.pid)
+        if len(worker_pids) != workers:
+            raise RuntimeError(f"Expected {workers} gunicorn workers, found {len(worker_pids)}")
+        master = process_memory_mb(server.pid)
+        per_worker = [process_memory_mb(pid) for pid in worker_pids]
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    return master, per_worker
+
+
+def run(workers=4):
+    """Per-worker RSS/PSS/USS and total PSS with private models versus a preloaded master"""
+    if shutil.which('gunicorn') is None or not os.path.exists('/proc/self/smaps_rollup'):
+        print("gunicorn or /proc/<pid>/smaps_rollup is unavailable, skipping the memory benchmark",
+              file=sys.stderr)
+        return {}
+
+    metrics = {}
+    for mode in MODES:
+        master, per_worker = measure(workers, preload=mode == 'preload')
+        prefix = f"memory.gunicorn_{workers}w.{mode}"
+        for kind in ('rss', 'pss', 'uss'):
+            metrics[f"{prefix}.worker_{kind}_mb"] = metric(np.mean([m[kind] for m in per_worker]), 'MB')
+        metrics[f"{prefix}.total_pss_mb"] = metric(master['pss'] + sum(m['pss'] for m in per_worker), 'MB')
+        print(f"  {mode:<8} per worker: RSS {metrics[prefix + '.worker_rss_mb']['value']:.1f}MB  "
+              f"PSS {metrics[prefix + '.worker_pss_mb']['value']:.1f}MB  "
+              f"private {metrics[prefix + '.worker_uss_mb']['value']:.1f}MB  "
+              f"total PSS {metrics[prefix + '.total_pss_mb']['value']:.1f}MB", file=sys.stderr)
+    return metrics
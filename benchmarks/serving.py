@@ -0,0 +1,108 @@
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from benchmarks.inference import random_records
+from benchmarks.timing import latency_metrics, throughput, time_calls
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_test_client(repeat=500):
+    """End-to-end /predict latency through the Flask test client (one thread)"""
+    os.environ.setdefault('PREDICTOR_STARTUP', 'eager')
+    from app import app
+    from routes import predictor
+
+    # The app logs every request at DEBUG level, which would dominate the timings
+    logging.getLogger().setLevel(logging.WARNING)
+    predictor.wait_until_loaded()
+    client = app.test_client()
+
+    forms = iter(random_records(predictor.symptoms, repeat + 20) * 2)
+    samples = time_calls(lambda: client.post('/predict', data={'symptoms': next(forms)}), repeat, warmup=20)
+
+    metrics = latency_metrics('http.test_client', samples, 1e3, 'ms')
+    metrics['http.test_client.requests_per_sec'] = throughput(1 / samples.mean(), 'req/s')
+    return metrics
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_ready(url, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            # Refused, reset or timed out while the workers are still booting
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def run_gunicorn(workers=4, concurrency=16, duration=10.0):
+    """/predict throughput against a local multi-worker gunicorn over real HTTP"""
+    if shutil.which('gunicorn') is None:
+        print("gunicorn is not installed, skipping the gunicorn benchmark", file=sys.stderr)
+        return {}
+
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, PREDICTOR_STARTUP='eager')
+    server = subprocess.Popen(
+        ['gunicorn', '--workers', str(workers), '--bind', f"127.0.0.1:{port}", 'main:app'],
+        cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        if not _wait_until_ready(f"{base_url}/healthz", timeout=60):
+            raise RuntimeError("gunicorn did not become ready within 60s")
+
+        bodies = [urllib.parse.urlencode({'symptoms': record}, doseq=True).encode()
+                  for record in random_records(['fever', 'cough', 'headache', 'fatigue', 'nausea',
+                                                'sore_throat', 'runny_nose', 'dizziness'], 1000)]
+        deadline = time.monotonic() + duration
+
+        def client(worker_id):
+            latencies = []
+            i = worker_id
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                with urllib.request.urlopen(f"{base_url}/predict", data=bodies[i % len(bodies)]) as response:
+                    response.read()
+                latencies.append(time.perf_counter() - start)
+                i += concurrency
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            samples = np.concatenate([np.asarray(latencies) for latencies in pool.map(client, range(concurrency))])
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    metrics = latency_metrics(f"http.gunicorn_{workers}w", samples, 1e3, 'ms')
+    metrics[f"http.gunicorn_{workers}w.requests_per_sec"] = throughput(len(samples) / elapsed, 'req/s')
+    return metrics
+
+
+def run():
+    metrics = run_test_client()
+    metrics.update(run_gunicorn())
+    return metrics
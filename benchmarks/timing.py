@@ -0,0 +1,35 @@
+import time
+
+import numpy as np
+
+
+def time_calls(fn, repeat, warmup=10):
+    """Call fn() repeat times after a warm-up and return per-call seconds"""
+    for _ in range(warmup):
+        fn()
+
+    samples = np.empty(repeat)
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples[i] = time.perf_counter() - start
+    return samples
+
+
+def latency_metrics(prefix, samples, unit_scale=1e6, unit='us'):
+    """p50/p90/p99/mean latency metrics (lower is better) from per-call seconds"""
+    scaled = np.asarray(samples) * unit_scale
+    metrics = {f"{prefix}.p{q}_{unit}": metric(np.percentile(scaled, q), unit)
+               for q in (50, 90, 99)}
+    metrics[f"{prefix}.mean_{unit}"] = metric(scaled.mean(), unit)
+    return metrics
+
+
+def metric(value, unit, better='lower'):
+    """One benchmark result; `better` says which direction is an improvement"""
+    return {'value': float(value), 'unit': unit, 'better': better}
+
+
+def throughput(value, unit):
+    """A rate metric, where higher is better"""
+    return metric(value, unit, better='higher')
@@ -0,0 +1,20 @@
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from benchmarks.timing import metric
+from data_generator import DISEASES, build_models, fit_models, generate_training_arrays
+from features import training_matrix
+
+
+def run(n_samples=2000):
+    """Fit time per model on the default training set size, without saving anything"""
+    X, y = generate_training_arrays(n_samples, 0)
+    X_train, X_test, y_train, y_test = train_test_split(training_matrix(X), np.asarray(DISEASES)[y],
+                                                        test_size=0.2, random_state=42)
+    _, report = fit_models(build_models(), X_train, y_train, X_test, y_test, parallel=False)
+
+    metrics = {}
+    for name, result in report.items():
+        metrics[f"training.{name}.seconds"] = metric(result['seconds'], 's')
+        metrics[f"training.{name}.accuracy"] = metric(result['accuracy'], 'ratio', better='higher')
+    return metrics
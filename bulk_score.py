@@ -0,0 +1,338 @@
+"""Score symptom files offline, in bounded memory, across a process pool
+
+Input is read in fixed-size chunks from CSV, JSONL or Parquet (Parquet
+needs pyarrow, the `parquet` extra). Two layouts are understood:
+
+- a `symptoms` column holding a list of symptom names per row, or in CSV a
+  string of names separated by `;`
+- one 0/1 column per symptom, as in the training data (columns outside the
+  model vocabulary are ignored, vocabulary columns that are missing count
+  as absent)
+
+Each chunk is scored as one feature matrix, through the prediction table
+when one was built for the models, otherwise through the model ensemble.
+At most two chunks per worker are in flight, and results are written in
+input order as they complete. Rows naming a symptom outside the vocabulary,
+or with a symptom column holding anything but 0/1, are written with an
+empty prediction.
+
+    python bulk_score.py intake.csv predictions.csv --workers 4
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from disease_predictor import DiseasePredictor
+from features import UnknownSymptomError, feature_matrix, symptom_columns, training_matrix
+from model_registry import REGISTRY_DIR
+from prediction_cache import MAX_BITMASK_SYMPTOMS, rows_bitmask
+
+FORMATS = ('csv', 'jsonl', 'parquet')
+CHUNK_ROWS = 100_000
+SYMPTOMS_COLUMN = 'symptoms'
+# Separator between symptom names in a CSV `symptoms` column
+SYMPTOM_SEPARATOR = ';'
+
+# Chunk payloads sent to the workers
+LISTS = 'lists'
+MATRIX = 'matrix'
+
+# The worker process's predictor, created by _init_worker
+_predictor = None
+
+
+def file_format(path):
+    """Format named by a file's extension"""
+    extension = os.path.splitext(path)[1].lower()
+    if extension in ('.jsonl', '.ndjson'):
+        return 'jsonl'
+    if extension in ('.parquet', '.pq'):
+        return 'parquet'
+    if extension == '.csv':
+        return 'csv'
+    raise ValueError(f"Cannot tell the format of {path}; pass --input-format/--output-format")
+
+
+def _parquet():
+    """pyarrow.parquet, which Parquet input and output need"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet files need pyarrow, which is optional: "
+                           "install the parquet extra (pip install '.[parquet]')") from None
+    return pq
+
+
+def iter_chunks(path, fmt, chunk_rows=CHUNK_ROWS):
+    """Yield DataFrames of at most chunk_rows rows from a CSV, JSONL or Parquet file"""
+    if fmt == 'csv':
+        yield from pd.read_csv(path, chunksize=chunk_rows)
+    elif fmt == 'jsonl':
+        with pd.read_json(path, lines=True, chunksize=chunk_rows) as reader:
+            yield from reader
+    elif fmt == 'parquet':
+        pq = _parquet()
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unknown input format: {fmt}")
+
+
+class ChunkWriter:
+    """Append DataFrame chunks to a CSV, JSONL or Parquet file
+
+    Writes go to a temporary file that replaces `path` on close, so a failed
+    run never leaves a truncated output behind.
+    """
+
+    def __init__(self, path, fmt):
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown output format: {fmt}")
+        self.path = path
+        self.fmt = fmt
+        self.tmp_path = path + '.tmp'
+        self._pq = _parquet() if fmt == 'parquet' else None
+        self._parquet = None
+        self._file = None if fmt == 'parquet' else open(self.tmp_path, 'w', newline='')
+        self._header = True
+
+    def write(self, df):
+        if self.fmt == 'csv':
+            df.to_csv(self._file, header=self._header, index=False)
+            self._header = False
+        elif self.fmt == 'jsonl':
+            if len(df):
+                text = df.to_json(orient='records', lines=True)
+                self._file.write(text if text.endswith('\n') else text + '\n')
+        else:
+            table = self._pq.lib.Table.from_pandas(df, preserve_index=False)
+            if self._parquet is None:
+                self._parquet = self._pq.ParquetWriter(self.tmp_path, table.schema)
+            self._parquet.write_table(table)
+
+    def close(self, commit=True):
+        if self._file is not None:
+            self._file.close()
+        if self._parquet is not None:
+            self._parquet.close()
+        if commit and os.path.exists(self.tmp_path):
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def chunk_payload(df, symptoms):
+    """What the workers need from an input chunk: symptom lists, or an aligned
+    0/1 matrix with a mask of the rows whose symptom columns are all 0 or 1"""
+    if SYMPTOMS_COLUMN in df.columns:
+        return LISTS, df[SYMPTOMS_COLUMN].tolist()
+
+    present = [symptom for symptom in symptoms if symptom in df.columns]
+    if not present:
+        raise ValueError(f"Input has neither a '{SYMPTOMS_COLUMN}' column nor any symptom columns")
+    matrix = np.zeros((len(df), len(symptoms)), dtype=np.int8)
+    valid = np.ones(len(df), dtype=bool)
+    for col, symptom in enumerate(symptoms):
+        if symptom in df.columns:
+            values = df[symptom].to_numpy()
+            # Anything else (2, NaN, text) would set the wrong bitmask bit
+            binary = (values == 0) | (values == 1)
+            valid &= binary
+            matrix[:, col] = np.where(binary, values, 0)
+    return MATRIX, (matrix, valid)
+
+
+def _record_symptoms(value):
+    """Symptom names from one `symptoms` cell: a list, a separated string or empty"""
+    if isinstance(value, str):
+        return [name.strip() for name in value.split(SYMPTOM_SEPARATOR) if name.strip()]
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return list(value)
+
+
+def _score_rows(predictor, feature_array, masks, use_table):
+    """(diseases, confidences) from the prediction table when there is one, else the models"""
+    table = predictor.prediction_table if use_table else None
+    if table is not None and masks is not None:
+        return table.lookup_many(masks)
+    if feature_array.dtype != np.float64:
+        feature_array = feature_array.astype(np.float64)
+    return predictor.predict_arrays(feature_array)
+
+
+def score_payload(predictor, payload, use_table=True):
+    """Score one chunk payload
+
+    Returns (version, disease codes into predictor.classes, confidences);
+    the code is -1 for rows with unknown symptoms or non-0/1 symptom
+    columns, or when nothing could be predicted.
+    """
+    kind, data = payload
+    symptom_index = predictor.symptom_index
+    n_symptoms = len(predictor.symptoms)
+    valid = None
+
+    if kind == LISTS:
+        records = [_record_symptoms(value) for value in data]
+        try:
+            columns = symptom_columns(records, symptom_index)
+        except UnknownSymptomError:
+            # Find the offending rows; the rest of the chunk is still scored
+            columns = []
+            valid = np.ones(len(records), dtype=bool)
+            for i, record in enumerate(records):
+                try:
+                    columns.extend(symptom_columns([record], symptom_index))
+                except UnknownSymptomError:
+                    columns.append([])
+                    valid[i] = False
+        feature_array = feature_matrix(columns, n_symptoms)
+    else:
+        matrix, valid = data
+        if valid.all():
+            valid = None
+        feature_array = training_matrix(matrix)
+
+    n_rows = feature_array.shape[0]
+    inverse = None
+    masks = None
+    if n_symptoms <= MAX_BITMASK_SYMPTOMS and n_rows:
+        # Intake records repeat a limited set of symptom combinations: score
+        # each distinct one once and fan the results back out
+        masks, first, inverse = np.unique(rows_bitmask(feature_array), return_index=True, return_inverse=True)
+        feature_array = feature_array[first]
+
+    diseases, confidences = _score_rows(predictor, feature_array, masks, use_table)
+    if diseases is None:
+        return predictor.version, np.full(n_rows, -1, dtype=np.int16), np.zeros(n_rows)
+
+    codes = np.searchsorted(predictor.classes, diseases.astype(str)).astype(np.int16)
+    if inverse is not None:
+        codes, confidences = codes[inverse], confidences[inverse]
+    if valid is not None:
+        codes[~valid] = -1
+        confidences = np.where(valid, confidences, 0.0)
+    return predictor.version, codes, confidences
+
+
+def _init_worker(registry_dir):
+    global _predictor
+    _predictor = DiseasePredictor(startup='eager', cache_size=0, registry_dir=registry_dir)
+
+
+def _score_in_worker(payload, use_table):
+    return score_payload(_predictor, payload, use_table)
+
+
+def _output_chunk(ids, id_column, classes, codes, confidences):
+    labels = np.asarray(list(classes) + [None], dtype=object)[codes]
+    output = pd.DataFrame({'disease': labels, 'confidence': np.round(confidences, 6)})
+    if id_column is not None:
+        output.insert(0, id_column, ids)
+    return output
+
+
+def bulk_score(input_path, output_path, input_format=None, output_format=None, chunk_rows=CHUNK_ROWS,
+               workers=None, id_column=None, use_table=True, progress_seconds=5.0, registry_dir=REGISTRY_DIR):
+    """Score every row of input_path into output_path and return a summary dict
+
+    With more than one worker, chunks are scored in a process pool whose
+    workers each load the models once. The run fails if the active model
+    version changes while it is in progress, so every row is scored by the
+    same models.
+    """
+    input_format = input_format or file_format(input_path)
+    output_format = output_format or file_format(output_path)
+    workers = workers or os.cpu_count() or 1
+    if 'parquet' in (input_format, output_format):
+        # Fail before loading models, not at the first chunk
+        _parquet()
+
+    predictor = DiseasePredictor(startup='eager', cache_size=0, registry_dir=registry_dir)
+    if not predictor.is_ready():
+        raise RuntimeError("No models are available; run 'python data_generator.py' first")
+    symptoms, classes, version = predictor.symptoms, predictor.classes, predictor.version
+
+    writer = ChunkWriter(output_path, output_format)
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(registry_dir,))
+
+    # (row ids, pending or finished result) per chunk, oldest first
+    in_flight = collections.deque()
+    rows = unscored = 0
+    start = last_report = time.perf_counter()
+
+    def write_oldest():
+        nonlocal rows, unscored, last_report
+        ids, result = in_flight.popleft()
+        chunk_version, codes, confidences = result.get() if pool is not None else result
+        if chunk_version != version:
+            raise RuntimeError(f"Model version changed from {version} to {chunk_version} during the run")
+        writer.write(_output_chunk(ids, id_column, classes, codes, confidences))
+        rows += len(codes)
+        unscored += int(np.count_nonzero(codes < 0))
+
+        now = time.perf_counter()
+        if now - last_report >= progress_seconds:
+            print(f"  {rows:,} rows, {rows / (now - start):,.0f} rows/s", file=sys.stderr)
+            last_report = now
+
+    committed = False
+    try:
+        for df in iter_chunks(input_path, input_format, chunk_rows):
+            if id_column is not None and id_column not in df.columns:
+                raise ValueError(f"Input has no '{id_column}' column")
+            ids = df[id_column].to_numpy() if id_column is not None else None
+            payload = chunk_payload(df, symptoms)
+            if pool is not None:
+                in_flight.append((ids, pool.apply_async(_score_in_worker, (payload, use_table))))
+            else:
+                in_flight.append((ids, score_payload(predictor, payload, use_table)))
+            # Bound memory: never read more than two chunks per worker ahead of the writer
+            while len(in_flight) > 2 * workers or (pool is None and in_flight):
+                write_oldest()
+        while in_flight:
+            write_oldest()
+        committed = True
+    finally:
+        writer.close(commit=committed)
+        if pool is not None:
+            if committed:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+    seconds = time.perf_counter() - start
+    return {'rows': rows, 'unscored': unscored, 'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else 0.0, 'version': version}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score a CSV/JSONL/Parquet file of symptom records")
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--input-format', choices=FORMATS, help="default: from the file extension")
+    parser.add_argument('--output-format', choices=FORMATS, help="default: from the file extension")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS, help="rows read and scored at a time")
+    parser.add_argument('--workers', type=int, default=None, help="scoring processes (default: CPU count)")
+    parser.add_argument('--id-column', help="input column copied to the output to identify rows")
+    parser.add_argument('--no-table', action='store_true', help="always run the models, even with a prediction table")
+    args = parser.parse_args()
+
+    try:
+        summary = bulk_score(args.input, args.output, args.input_format, args.output_format, args.chunk_rows,
+                             args.workers, args.id_column, use_table=not args.no_table)
+    except RuntimeError as error:
+        parser.exit(1, f"error: {error}\n")
+    print(f"Scored {summary['rows']:,} rows in {summary['seconds']:.1f}s "
+          f"({summary['rows_per_second']:,.0f} rows/s, model version {summary['version']}); "
+          f"{summary['unscored']:,} rows without a prediction -> {args.output}")
@@ -3,10 +3,18 @@ import numpy as np
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.naive_bayes import MultinomialNB
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.metrics import accuracy_score
+from concurrent.futures import ProcessPoolExecutor
+import argparse
 import joblib
+import multiprocessing
 import os
+import threading
+import time
+from features import stack_rows, training_matrix
+from model_registry import file_sha256, publish_version
+from tree_engine import compile_forest, is_forest
 
 # Common symptoms and diseases for medical prediction
 SYMPTOMS = [
@@ -66,86 +74,316 @@ DISEASE_PATTERNS = {
     }
 }
 
-def generate_training_data(n_samples=1000):
-    """Generate synthetic training data based on disease-symptom patterns"""
-    data = []
+# Probability of a symptom that is not part of a disease's pattern
+BACKGROUND_SYMPTOM_PROB = 0.1
+
+def symptom_probability_matrix():
+    """Build the disease x symptom probability matrix from DISEASE_PATTERNS"""
+    matrix = np.full((len(DISEASES), len(SYMPTOMS)), BACKGROUND_SYMPTOM_PROB)
+    symptom_index = {symptom: i for i, symptom in enumerate(SYMPTOMS)}
     
-    for _ in range(n_samples):
-        # Randomly select a disease
-        disease = np.random.choice(DISEASES)
-        
-        # Generate symptoms based on disease patterns
-        symptoms_vector = [0] * len(SYMPTOMS)
-        disease_pattern = DISEASE_PATTERNS[disease]
-        
-        for i, symptom in enumerate(SYMPTOMS):
-            if symptom in disease_pattern:
-                # Use disease-specific probability
-                prob = disease_pattern[symptom]
-            else:
-                # Low probability for symptoms not associated with disease
-                prob = 0.1
-            
-            # Add some noise to make it more realistic
-            prob = prob * np.random.uniform(0.8, 1.2)
-            prob = max(0, min(1, prob))  # Keep probability between 0 and 1
-            
-            symptoms_vector[i] = 1 if np.random.random() < prob else 0
-        
-        # Ensure at least one symptom is present
-        if sum(symptoms_vector) == 0:
-            symptoms_vector[np.random.randint(len(SYMPTOMS))] = 1
-        
-        data.append(symptoms_vector + [disease])
+    for d, disease in enumerate(DISEASES):
+        for symptom, prob in DISEASE_PATTERNS[disease].items():
+            matrix[d, symptom_index[symptom]] = prob
+    
+    return matrix
+
+PROBABILITY_MATRIX = symptom_probability_matrix()
+
+def generate_training_arrays(n_samples, rng=None):
+    """Generate (X, y): an int8 symptom matrix and int8 indices into DISEASES
+    
+    `rng` is a np.random.Generator or anything np.random.default_rng accepts.
+    """
+    rng = np.random.default_rng(rng)
+    n_symptoms = len(SYMPTOMS)
+    
+    # Randomly select a disease per row
+    y = rng.integers(len(DISEASES), size=n_samples, dtype=np.int8)
+    
+    # Disease-specific probabilities with some noise to make it more realistic
+    prob = PROBABILITY_MATRIX[y]
+    prob *= rng.uniform(0.8, 1.2, size=prob.shape)
+    np.clip(prob, 0, 1, out=prob)
+    
+    X = rng.random(prob.shape) < prob
+    del prob
+    
+    # Ensure at least one symptom is present
+    empty = np.flatnonzero(~X.any(axis=1))
+    if len(empty):
+        X[empty, rng.integers(n_symptoms, size=len(empty))] = True
+    
+    return X.view(np.int8), y
+
+def iter_training_chunks(n_samples, chunk_size=250_000, seed=None):
+    """Yield (X, y) chunks of at most chunk_size rows, n_samples rows in total"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, n_samples, chunk_size):
+        yield generate_training_arrays(min(chunk_size, n_samples - start), rng)
+
+def generate_training_data(n_samples=1000, seed=None):
+    """Generate synthetic training data based on disease-symptom patterns"""
+    X, y = generate_training_arrays(n_samples, seed)
     
     # Create DataFrame
-    columns = SYMPTOMS + ['disease']
-    df = pd.DataFrame(data, columns=columns)
+    df = pd.DataFrame(X, columns=SYMPTOMS)
+    df['disease'] = np.asarray(DISEASES)[y]
     
     return df
 
-def train_models():
-    """Train multiple ML models for disease prediction"""
+def write_training_shards(n_samples, out_dir, chunk_size=1_000_000, seed=None, fmt='npy'):
+    """Stream synthetic data to fixed-size shards in out_dir, in bounded memory
+    
+    fmt='npy' writes shard-NNNNN.X.npy / shard-NNNNN.y.npy pairs, fmt='parquet'
+    writes one shard-NNNNN.parquet per chunk (needs the parquet extra, pyarrow).
+    """
+    if fmt not in ('npy', 'parquet'):
+        raise ValueError(f"Unknown shard format: {fmt}")
+    
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    
+    for i, (X, y) in enumerate(iter_training_chunks(n_samples, chunk_size, seed)):
+        stem = os.path.join(out_dir, f"shard-{i:05d}")
+        if fmt == 'npy':
+            np.save(f"{stem}.X.npy", X)
+            np.save(f"{stem}.y.npy", y)
+            paths.append(f"{stem}.X.npy")
+        else:
+            df = pd.DataFrame(X, columns=SYMPTOMS)
+            df['disease'] = pd.Categorical.from_codes(y, categories=DISEASES)
+            df.to_parquet(f"{stem}.parquet", index=False)
+            paths.append(f"{stem}.parquet")
+    
+    return paths
+
+def iter_training_shards(shard_dir, mmap=True):
+    """Yield (X, y) from shards written by write_training_shards, in order"""
+    for name in sorted(os.listdir(shard_dir)):
+        path = os.path.join(shard_dir, name)
+        if name.endswith('.X.npy'):
+            X = np.load(path, mmap_mode='r' if mmap else None)
+            y = np.load(path[:-len('.X.npy')] + '.y.npy')
+            yield X, y
+        elif name.endswith('.parquet'):
+            df = pd.read_parquet(path)
+            yield df[SYMPTOMS].to_numpy(dtype=np.int8), df['disease'].cat.codes.to_numpy(dtype=np.int8)
+
+def build_models(n_jobs=-1):
+    """Untrained estimators for the ensemble; the forest uses n_jobs cores"""
+    return {
+        'random_forest': RandomForestClassifier(n_estimators=100, random_state=42, n_jobs=n_jobs),
+        'naive_bayes': MultinomialNB(),
+        'logistic_regression': LogisticRegression(max_iter=1000, random_state=42)
+    }
+
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+# How often measure_fit samples the resident set size
+RSS_SAMPLE_SECONDS = 0.002
+
+def resident_memory_bytes():
+    """Current resident set size of this process, or None without /proc"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except OSError:
+        return None
+
+def measure_fit(fit, *args, **kwargs):
+    """Call fit(*args, **kwargs) and return (seconds, peak_memory_mb) for that call
+    
+    The resident set size is sampled by a thread every RSS_SAMPLE_SECONDS
+    while fit runs; peak_memory_mb is how far it rose above its size when
+    the call started. That is the call's own peak, including memory
+    allocated in C (sklearn's tree nodes), not the process high-water mark
+    left behind by earlier fits (memory they freed and this call reuses
+    does not show up). It is None where /proc is unavailable.
+    """
+    baseline = resident_memory_bytes()
+    peak = [baseline or 0]
+    done = threading.Event()
+    
+    def sample():
+        while not done.wait(RSS_SAMPLE_SECONDS):
+            peak[0] = max(peak[0], resident_memory_bytes())
+    
+    sampler = threading.Thread(target=sample, daemon=True)
+    if baseline is not None:
+        sampler.start()
+    start = time.perf_counter()
+    try:
+        fit(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+    if baseline is None:
+        return seconds, None
+    sampler.join()
+    peak_memory_mb = (max(peak[0], resident_memory_bytes()) - baseline) / (1024 * 1024)
+    return seconds, peak_memory_mb
+
+def fit_and_evaluate(name, model, X_train, y_train, X_test, y_test):
+    """Fit one model and measure its accuracy, wall-clock time and peak memory"""
+    seconds, peak_memory_mb = measure_fit(model.fit, X_train, y_train)
+    
+    accuracy = accuracy_score(y_test, model.predict(X_test))
+    return name, model, {'accuracy': accuracy, 'seconds': seconds, 'peak_memory_mb': peak_memory_mb}
+
+def fit_models(models, X_train, y_train, X_test, y_test, parallel=True):
+    """Fit all models, concurrently in a process pool unless parallel is False
+    
+    Returns (trained_models, report) with a report entry per model. Workers
+    are forked, so there is no re-import cost; on a single core the pool
+    cannot help and the models are fitted in-process.
+    """
+    if not parallel or (os.cpu_count() or 1) == 1:
+        results = [fit_and_evaluate(name, model, X_train, y_train, X_test, y_test)
+                   for name, model in models.items()]
+    else:
+        with ProcessPoolExecutor(max_workers=len(models), mp_context=multiprocessing.get_context('fork')) as pool:
+            futures = [pool.submit(fit_and_evaluate, name, model, X_train, y_train, X_test, y_test)
+                       for name, model in models.items()]
+            results = [future.result() for future in futures]
+    
+    trained_models = {name: model for name, model, _ in results}
+    report = {name: metrics for name, _, metrics in results}
+    return trained_models, report
+
+def print_report(report, wall_seconds):
+    """Print per-model accuracy, fit time and peak memory during the fit"""
+    for name, metrics in report.items():
+        memory = metrics['peak_memory_mb']
+        memory = 'n/a' if memory is None else f"{memory:.1f}MB"
+        print(f"{name:<20} accuracy: {metrics['accuracy']:.3f}  "
+              f"time: {metrics['seconds']:.2f}s  peak memory: {memory}")
+    print(f"Total wall-clock time: {wall_seconds:.2f}s")
+
+def save_models(trained_models, model_dir="models"):
+    """Save trained models and the symptom list as joblib artifacts"""
+    os.makedirs(model_dir, exist_ok=True)
+    for name, model in trained_models.items():
+        path = os.path.join(model_dir, f"{name}.joblib")
+        joblib.dump(model, path)
+        if is_forest(model):
+            compile_forest(path, file_sha256(path), model)
+    
+    # Save symptoms list for later use
+    joblib.dump(SYMPTOMS, os.path.join(model_dir, "symptoms.joblib"))
+
+def train_models(n_samples=2000, parallel=True, n_jobs=-1, seed=None, publish=False):
+    """Train multiple ML models for disease prediction
+    
+    With publish=True the models also become a new version in the model
+    registry, which running predictors hot-swap to.
+    """
+    start = time.perf_counter()
     print("Generating training data...")
-    df = generate_training_data(2000)
+    X, y = generate_training_arrays(n_samples, seed)
     
-    # Prepare features and target
-    X = df[SYMPTOMS]
-    y = df['disease']
+    # Prepare features and target; large vocabularies train on CSR
+    X = training_matrix(X)
+    y = np.asarray(DISEASES)[y]
     
     # Split data
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
     
+    print("Training models...")
+    trained_models, report = fit_models(build_models(n_jobs), X_train, y_train, X_test, y_test, parallel)
+    save_models(trained_models)
+    if publish:
+        publish_version(trained_models, SYMPTOMS, report)
+    
+    print_report(report, time.perf_counter() - start)
+    print("Models trained and saved successfully!")
+    return trained_models
+
+def train_models_incremental(chunks, holdout_rows=20_000, forest_rows=200_000, n_jobs=-1, publish=False):
+    """Train on an iterable of (X, y) chunks without holding the dataset in memory
+    
+    Naive Bayes and an SGD logistic model learn chunk by chunk through
+    partial_fit. A random forest cannot, so it is fitted once on the first
+    forest_rows training rows. The first holdout_rows rows are kept aside
+    for evaluation.
+    """
+    start = time.perf_counter()
+    labels = np.asarray(DISEASES)
     models = {
-        'random_forest': RandomForestClassifier(n_estimators=100, random_state=42),
         'naive_bayes': MultinomialNB(),
-        'logistic_regression': LogisticRegression(max_iter=1000, random_state=42)
+        'logistic_regression': SGDClassifier(loss='log_loss', random_state=42)
     }
+    seconds = dict.fromkeys(['random_forest', *models], 0.0)
+    peak_memory_mb = dict.fromkeys(['random_forest', *models])
     
-    print("Training models...")
-    trained_models = {}
+    X_holdout, y_holdout = [], []
+    X_forest, y_forest = [], []
+    n_holdout = n_forest = 0
     
-    for name, model in models.items():
-        print(f"Training {name}...")
-        model.fit(X_train, y_train)
+    print("Training models incrementally...")
+    for X, y in chunks:
+        y = labels[y]
+        X = training_matrix(np.asarray(X))
         
-        # Evaluate model
-        y_pred = model.predict(X_test)
-        accuracy = accuracy_score(y_test, y_pred)
-        print(f"{name} accuracy: {accuracy:.3f}")
+        if n_holdout < holdout_rows:
+            take = holdout_rows - n_holdout
+            X_holdout.append(X[:take])
+            y_holdout.append(y[:take])
+            n_holdout += len(y_holdout[-1])
+            X, y = X[take:], y[take:]
         
-        # Save model
-        model_path = f"models/{name}.joblib"
-        os.makedirs("models", exist_ok=True)
-        joblib.dump(model, model_path)
+        if n_forest < forest_rows and len(y):
+            take = forest_rows - n_forest
+            X_forest.append(X[:take])
+            y_forest.append(y[:take])
+            n_forest += len(y_forest[-1])
         
-        trained_models[name] = model
+        for name, model in models.items():
+            if len(y):
+                chunk_seconds, chunk_memory_mb = measure_fit(model.partial_fit, X, y, classes=labels)
+                seconds[name] += chunk_seconds
+                if chunk_memory_mb is not None:
+                    peak_memory_mb[name] = max(peak_memory_mb[name] or 0.0, chunk_memory_mb)
     
-    # Save symptoms list for later use
-    joblib.dump(SYMPTOMS, "models/symptoms.joblib")
+    if not X_forest:
+        raise ValueError(f"Need more than {holdout_rows} rows to train incrementally")
     
+    forest = build_models(n_jobs)['random_forest']
+    X_forest, y_forest = stack_rows(X_forest), np.concatenate(y_forest)
+    seconds['random_forest'], peak_memory_mb['random_forest'] = measure_fit(forest.fit, X_forest, y_forest)
+    trained_models = {'random_forest': forest, **models}
+    
+    X_holdout, y_holdout = stack_rows(X_holdout), np.concatenate(y_holdout)
+    report = {name: {'accuracy': accuracy_score(y_holdout, model.predict(X_holdout)),
+                     'seconds': seconds[name],
+                     'peak_memory_mb': peak_memory_mb[name]}
+              for name, model in trained_models.items()}
+    save_models(trained_models)
+    if publish:
+        publish_version(trained_models, SYMPTOMS, report)
+    
+    print_report(report, time.perf_counter() - start)
     print("Models trained and saved successfully!")
     return trained_models
 
 if __name__ == "__main__":
-    train_models()
+    parser = argparse.ArgumentParser(description="Generate synthetic data and train the disease models")
+    parser.add_argument('--samples', type=int, default=2000, help="number of rows to generate")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--sequential', action='store_true', help="fit models one after another")
+    parser.add_argument('--incremental', action='store_true', help="train out-of-core with partial_fit")
+    parser.add_argument('--shards', help="train incrementally from shards in this directory")
+    parser.add_argument('--write-shards', help="only write the generated data as shards to this directory")
+    parser.add_argument('--format', choices=['npy', 'parquet'], default='npy', help="shard format")
+    parser.add_argument('--chunk-size', type=int, default=250_000, help="rows per chunk or shard")
+    parser.add_argument('--publish', action='store_true', help="also publish the models as a new registry version")
+    args = parser.parse_args()
+    
+    if args.write_shards:
+        paths = write_training_shards(args.samples, args.write_shards, args.chunk_size, args.seed, args.format)
+        print(f"Wrote {len(paths)} shards to {args.write_shards}")
+    elif args.shards:
+        train_models_incremental(iter_training_shards(args.shards), publish=args.publish)
+    elif args.incremental:
+        train_models_incremental(iter_training_chunks(args.samples, args.chunk_size, args.seed), publish=args.publish)
+    else:
+        train_models(args.samples, parallel=not args.sequential, seed=args.seed, publish=args.publish)
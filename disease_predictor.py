@@ -1,13 +1,110 @@
 import joblib
+import logging
 import numpy as np
 import os
-from collections import Counter
+import threading
+import time
+from scipy import sparse
+from features import UnknownSymptomError, feature_matrix, symptom_columns
+from linear_engine import LinearEnsemble
+from metrics import Counter, Histogram
+from model_registry import REGISTRY_DIR, current_version, file_sha256, read_manifest, verify_checksums
+from prediction_cache import LRUCache, PredictionTable, TABLE_FILE, columns_bitmask, model_fingerprint
+from scoring_session import ScoringSession
+from tree_engine import FlatForest, forest_path, is_forest, load_compiled_forest
+
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = "models"
+MODEL_FILES = ['random_forest.joblib', 'naive_bayes.joblib', 'logistic_regression.joblib']
+MODEL_NAMES = [model_file.replace('.joblib', '') for model_file in MODEL_FILES]
+
+# Readiness states reported by DiseasePredictor.readiness()
+STARTING = 'starting'
+READY = 'ready'
+DEGRADED = 'degraded'
+UNAVAILABLE = 'unavailable'
+
+# Startup modes: load in the constructor, in a warm-up thread, or on first use
+STARTUP_MODES = ('eager', 'background', 'lazy')
+
+# Cascade gates: the top mean probability, or its lead over the runner-up
+CONFIDENCE = 'confidence'
+MARGIN = 'margin'
+CASCADE_METRICS = (CONFIDENCE, MARGIN)
+# Stage reported for rows that went through every model and the majority vote
+ENSEMBLE_STAGE = 'ensemble'
+
+# Hot-path instrumentation, exposed by the /metrics route
+STAGE_SECONDS = Histogram('predictor_stage_seconds', "Time spent per prediction stage", ['stage'])
+MODEL_SECONDS = Histogram('predictor_model_seconds', "Time spent scoring one batch per model", ['model'])
+MODEL_ERRORS = Counter('predictor_model_errors_total', "Model scoring failures", ['model'])
+PREDICTIONS = Counter('predictor_predictions_total', "Predictions served, by where the answer came from", ['source'])
+CASCADE_EXITS = Counter('predictor_cascade_exits_total', "Cascade predictions, by the stage that answered", ['stage'])
+
+class ModelBundle:
+    """Everything one model version needs to serve predictions
+    
+    The predictor swaps whole bundles. A request reads the current bundle
+    once and uses it throughout, so it is never affected by a concurrent
+    swap and a prediction never mixes models from two versions.
+    """
+    
+    def __init__(self, version=None, model_dir=MODEL_DIR, symptoms=(), models=None,
+                 missing_models=(), state=STARTING, cache_size=0):
+        self.version = version
+        self.model_dir = model_dir
+        self.symptoms = list(symptoms)
+        self.models = models or {}
+        self.missing_models = list(missing_models)
+        self.symptom_index = {symptom: i for i, symptom in enumerate(self.symptoms)}
+        self.classes = sorted({str(c) for model in self.models.values() for c in model.classes_})
+        self.state = state
+        self.linear_engine = None
+        # (model name, scorer) pairs cheapest first; empty if a model cannot be gated
+        self.cascade = []
+        # (class array, explain the linear engine?, forest names) for explanations, built by _prepare
+        self.explainers = None
+        self.fingerprint = None
+        self.prediction_table = None
+        self.cache = LRUCache(cache_size)
+        self.timings = {}
+    
+    @property
+    def is_ready(self):
+        return self.state in (READY, DEGRADED)
 
 class DiseasePredictor:
-    def __init__(self):
-        self.models = {}
-        self.symptoms = []
-        self.load_models()
+    def __init__(self, use_compiled=True, cache_size=4096, use_prediction_table=True, startup='eager',
+                 registry_dir=REGISTRY_DIR, cascade_threshold=None, cascade_metric=CONFIDENCE):
+        if startup not in STARTUP_MODES:
+            raise ValueError(f"Unknown startup mode: {startup}")
+        if cascade_metric not in CASCADE_METRICS:
+            raise ValueError(f"Unknown cascade metric: {cascade_metric}")
+        
+        self.startup = startup
+        # Models come from the active version in the registry, or from the
+        # flat models/ directory when no version has been published
+        self.registry_dir = registry_dir
+        # Linear models are scored through a compiled weight matrix and forests
+        # through flattened node arrays unless use_compiled is False, which
+        # keeps the plain sklearn path as reference
+        self.use_compiled = use_compiled
+        # Single predictions are served from a precomputed table when one was
+        # built for these models, otherwise from an LRU cache keyed by bitmask
+        self.cache_size = cache_size
+        self.use_prediction_table = use_prediction_table
+        # With a cascade threshold, models run cheapest first and a row stops
+        # as soon as the mean probability of the models so far (or its margin
+        # over the runner-up) reaches the threshold; None runs every model
+        self.cascade_threshold = cascade_threshold
+        self.cascade_metric = cascade_metric
+        self._bundle = ModelBundle(cache_size=cache_size)
+        self._load_lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._rejected_version = None
+        self._watcher = None
+        self._stop_watching = threading.Event()
         
         # Disease information and prevention tips
         self.disease_info = {
@@ -183,80 +280,725 @@ class DiseasePredictor:
             }
         }
     
+        
+        if startup == 'eager':
+            self.load_models()
+        elif startup == 'background':
+            self._start_warmup()
+    
+    def _start_warmup(self):
+        threading.Thread(target=self.load_models, name='model-warmup', daemon=True).start()
+    
+    def after_fork(self):
+        """Restore per-process state in a worker forked from a preloading parent
+        
+        Threads do not survive fork(): a parent's registry watcher is
+        forgotten so that watch_registry starts a new one, an unfinished
+        background warm-up is restarted, and the load lock is replaced in
+        case a parent thread held it. Loaded models are inherited as they are.
+        """
+        self._load_lock = threading.Lock()
+        if self._watcher is not None:
+            self._watcher = None
+            self._stop_watching = threading.Event()
+        if self.startup == 'background' and not self._loaded.is_set():
+            self._start_warmup()
+    
+    # The current bundle, for a request that must use one model version
+    # throughout, and read-only views of it
+    bundle = property(lambda self: self._bundle)
+    models = property(lambda self: self._bundle.models)
+    symptoms = property(lambda self: self._bundle.symptoms)
+    symptom_index = property(lambda self: self._bundle.symptom_index)
+    classes = property(lambda self: self._bundle.classes)
+    state = property(lambda self: self._bundle.state)
+    version = property(lambda self: self._bundle.version)
+    model_dir = property(lambda self: self._bundle.model_dir)
+    missing_models = property(lambda self: self._bundle.missing_models)
+    linear_engine = property(lambda self: self._bundle.linear_engine)
+    cascade = property(lambda self: [model_name for model_name, _ in self._bundle.cascade])
+    fingerprint = property(lambda self: self._bundle.fingerprint)
+    prediction_table = property(lambda self: self._bundle.prediction_table)
+    cache = property(lambda self: self._bundle.cache)
+    startup_timings = property(lambda self: self._bundle.timings)
+    
     def load_models(self):
-        """Load trained models and symptoms list"""
+        """Load trained models and symptoms list, swapping them in atomically
+        
+        Never trains: missing artifacts leave the predictor degraded (some
+        models) or unavailable (no models or symptom list). Large arrays are
+        memory-mapped rather than copied into each process. Returns True if
+        the new models were swapped in.
+        """
+        with self._load_lock:
+            return self._load()
+    
+    reload = load_models
+    
+    def _load(self):
+        """Build a bundle and swap it in unless it would replace working models
+        with broken ones; caller holds _load_lock"""
+        bundle = self._build_bundle()
+        swapped = bundle.is_ready or not self._bundle.is_ready
+        if swapped:
+            self._bundle = bundle
+            self._rejected_version = None
+        else:
+            self._rejected_version = bundle.version
+            logger.error(f"Model version {bundle.version} failed to load, "
+                         f"keeping version {self._bundle.version}")
+        self._loaded.set()
+        
+        breakdown = ', '.join(f"{name} {seconds * 1000:.1f}ms" for name, seconds in bundle.timings.items())
+        logger.info(f"Predictor {bundle.state} (version {bundle.version}): {breakdown}")
+        if bundle.missing_models:
+            logger.warning(f"Missing model artifacts {bundle.missing_models}; "
+                           f"run 'python data_generator.py' to train them")
+        return swapped
+    
+    def _build_bundle(self):
+        """Load, validate and warm up the active model version off the request path"""
+        timings = {}
+        start = time.perf_counter()
+        version = current_version(self.registry_dir)
         try:
-            if os.path.exists("models/symptoms.joblib"):
-                self.symptoms = joblib.load("models/symptoms.joblib")
+            if version is not None:
+                bundle = self._load_version(version, timings)
+            else:
+                bundle = self._load_directory(timings)
+            self._prepare(bundle, timings)
+        except Exception as e:
+            logger.exception(f"Error loading models: {e}")
+            bundle = ModelBundle(version=version, state=UNAVAILABLE)
+        
+        timings['total'] = time.perf_counter() - start
+        bundle.timings = timings
+        return bundle
+    
+    def _load_version(self, version, timings):
+        """Load a registry version after checking its manifest checksums"""
+        version_dir = os.path.join(self.registry_dir, version)
+        manifest = read_manifest(version_dir)
+        
+        step = time.perf_counter()
+        verify_checksums(version_dir, manifest)
+        timings['verify'] = time.perf_counter() - step
+        
+        models = {}
+        for model_name in MODEL_NAMES:
+            entry = manifest['models'].get(model_name)
+            if entry is not None:
+                step = time.perf_counter()
+                models[model_name] = self._load_model(os.path.join(version_dir, entry['file']), entry['sha256'])
+                timings[model_name] = time.perf_counter() - step
+        
+        missing = [model_name for model_name in MODEL_NAMES if model_name not in models]
+        return ModelBundle(version, version_dir, manifest['symptoms'], models, missing,
+                           cache_size=self.cache_size)
+    
+    def _load_directory(self, timings):
+        """Load the unversioned artifacts in MODEL_DIR"""
+        step = time.perf_counter()
+        symptoms_path = os.path.join(MODEL_DIR, "symptoms.joblib")
+        symptoms = joblib.load(symptoms_path) if os.path.exists(symptoms_path) else []
+        timings['symptoms'] = time.perf_counter() - step
+        
+        models = {}
+        missing = []
+        
+        for model_file in MODEL_FILES:
+            model_path = os.path.join(MODEL_DIR, model_file)
+            model_name = model_file.replace('.joblib', '')
+            if not os.path.exists(model_path):
+                missing.append(model_name)
+                continue
             
-            model_files = ['random_forest.joblib', 'naive_bayes.joblib', 'logistic_regression.joblib']
+            step = time.perf_counter()
+            models[model_name] = self._load_model(model_path)
+            timings[model_name] = time.perf_counter() - step
+        
+        return ModelBundle(None, MODEL_DIR, symptoms, models, missing, cache_size=self.cache_size)
+    
+    def _load_model(self, model_path, sha256=None):
+        """Load one artifact, preferring a FlatForest saved from exactly this file"""
+        if self.use_compiled and os.path.exists(forest_path(model_path)):
+            flat = load_compiled_forest(model_path, sha256 or file_sha256(model_path))
+            if flat is not None:
+                return flat
+        return joblib.load(model_path, mmap_mode='r')
+    
+    def _prepare(self, bundle, timings):
+        """Validate a freshly loaded bundle, compile it and decide its state"""
+        for model_name, model in bundle.models.items():
+            n_features = getattr(model, 'n_features_in_', len(bundle.symptoms))
+            if n_features != len(bundle.symptoms):
+                raise ValueError(f"{model_name} expects {n_features} features "
+                                 f"but there are {len(bundle.symptoms)} symptoms")
+        
+        if not bundle.models or not bundle.symptoms:
+            bundle.state = UNAVAILABLE
+            return
+        
+        step = time.perf_counter()
+        if self.use_compiled:
+            bundle.linear_engine = LinearEnsemble.compile(bundle.models, len(bundle.symptoms))
+            for model_name, model in list(bundle.models.items()):
+                if is_forest(model):
+                    flat = FlatForest.from_estimator(model)
+                    if flat.check_parity(model):
+                        bundle.models[model_name] = flat
+                    else:
+                        logger.warning(f"Flattened {model_name} does not match sklearn, keeping the sklearn model")
+        timings['compile'] = time.perf_counter() - step
+        
+        step = time.perf_counter()
+        model_paths = [os.path.join(bundle.model_dir, f"{model_name}.joblib") for model_name in bundle.models]
+        bundle.fingerprint = model_fingerprint(model_paths)
+        if self.use_prediction_table:
+            table_path = os.path.join(bundle.model_dir, TABLE_FILE)
+            bundle.prediction_table = PredictionTable.load(table_path, bundle.symptoms, bundle.fingerprint)
+        timings['prediction_table'] = time.perf_counter() - step
+        
+        # Explanations are served from precomputed forest paths, built here
+        # rather than by the first request that asks for one
+        step = time.perf_counter()
+        bundle.explainers = self._explainers(bundle)
+        for model_name in bundle.explainers[2]:
+            bundle.models[model_name].prepare_explanations()
+        timings['explainers'] = time.perf_counter() - step
+        
+        bundle.state = DEGRADED if bundle.missing_models else READY
+        
+        # Warm up every model once so the first real request pays no lazy setup
+        step = time.perf_counter()
+        diseases, _ = self._ensemble_arrays(bundle, np.zeros((1, len(bundle.symptoms))))
+        if diseases is None:
+            raise ValueError("No model could score a warm-up input")
+        timings['warmup'] = time.perf_counter() - step
+        
+        step = time.perf_counter()
+        bundle.cascade = self._cascade_stages(bundle)
+        timings['cascade'] = time.perf_counter() - step
+    
+    @classmethod
+    def _cascade_stages(cls, bundle, repeat=5):
+        """Order the models for the cascade by their measured scoring cost"""
+        scorers = {model_name: cls._stage_scorer(bundle, model_name, model)
+                   for model_name, model in bundle.models.items()}
+        if any(scorer is None for scorer in scorers.values()):
+            logger.info("Cascade disabled: some models have no predict_proba")
+            return []
+        
+        probe = np.random.default_rng(0).integers(0, 2, size=(16, len(bundle.symptoms))).astype(np.float64)
+        costs = {}
+        for model_name, scorer in scorers.items():
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                scorer(probe)
+                samples.append(time.perf_counter() - start)
+            costs[model_name] = min(samples)
+        
+        order = sorted(scorers, key=costs.get)
+        logger.info("Cascade order: " + ", ".join(f"{name} ({costs[name] * 1e6:.0f}us)" for name in order))
+        return [(model_name, scorers[model_name]) for model_name in order]
+    
+    @staticmethod
+    def _stage_scorer(bundle, model_name, model):
+        """Callable giving one model's probabilities in bundle.classes column order"""
+        engine = bundle.linear_engine
+        if engine is not None and model_name in engine.names:
+            engine = engine.select([model_name])
+            model_classes = engine.classes
+            score = lambda feature_array: engine.predict_proba(feature_array)[0]
+        elif hasattr(model, 'predict_proba'):
+            model_classes = model.classes_
+            score = model.predict_proba
+        else:
+            return None
+        
+        columns = np.searchsorted(np.asarray(bundle.classes), np.asarray(model_classes).astype(str))
+        if np.array_equal(columns, np.arange(len(bundle.classes))):
+            return score
+        
+        def aligned(feature_array):
+            proba = np.zeros((feature_array.shape[0], len(bundle.classes)))
+            proba[:, columns] = score(feature_array)
+            return proba
+        return aligned
+    
+    def ensure_loaded(self):
+        """Load the models on first use when the predictor was started lazily"""
+        if self.startup == 'lazy' and not self._loaded.is_set():
+            with self._load_lock:
+                if not self._loaded.is_set():
+                    self._load()
+    
+    def wait_until_loaded(self, timeout=None):
+        """Block until the first load attempt has finished; True if it did"""
+        return self._loaded.wait(timeout)
+    
+    def watch_registry(self, interval=5.0):
+        """Poll the registry and hot-swap whenever CURRENT names a new version"""
+        if self._watcher is not None:
+            return
+        self._watch_interval = interval
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,),
+                                         name='model-watcher', daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        """Stop the registry watcher thread"""
+        if self._watcher is not None:
+            self._stop_watching.set()
+            self._watcher.join()
+            self._watcher = None
+    
+    def _watch(self, interval):
+        while not self._stop_watching.wait(interval):
+            latest = current_version(self.registry_dir)
+            if latest is not None and latest not in (self.version, self._rejected_version):
+                logger.info(f"Model version {latest} published, reloading")
+                self.reload()
+    
+    def is_ready(self):
+        """True when predictions can be served, possibly by a reduced ensemble"""
+        return self._bundle.is_ready
+    
+    def readiness(self):
+        """Readiness state, loaded/missing models and the startup time breakdown"""
+        bundle = self._bundle
+        return {
+            'status': bundle.state,
+            'version': bundle.version,
+            'models': list(bundle.models),
+            'missing_models': list(bundle.missing_models),
+            'cascade': [model_name for model_name, _ in bundle.cascade] if self.cascade_threshold is not None else None,
+            'startup_ms': {name: round(seconds * 1000, 2) for name, seconds in bundle.timings.items()},
+        }
+    
+    def predict_disease(self, selected_symptoms, return_bundle=False):
+        """Predict disease based on selected symptoms
+        
+        With return_bundle, returns (prediction, bundle) as predict_cached does.
+        """
+        results, bundle = self.predict_cached([selected_symptoms], return_bundle=True)
+        return (results[0], bundle) if return_bundle else results[0]
+    
+    def validate_symptoms(self, selected_symptoms):
+        """Raise UnknownSymptomError unless every name is in the loaded vocabulary
+        
+        Nothing is checked while no models are loaded.
+        """
+        self.ensure_loaded()
+        bundle = self._bundle
+        if bundle.is_ready:
+            symptom_columns([selected_symptoms], bundle.symptom_index)
+    
+    def symptom_bitmask(self, selected_symptoms, bundle=None):
+        """Bitmask of validated symptoms over the loaded vocabulary (0 while nothing is loaded)
+        
+        Pass the bundle a prediction came from to get the mask over its vocabulary.
+        """
+        bundle = bundle or self._bundle
+        if not bundle.is_ready:
+            return 0
+        return columns_bitmask(symptom_columns([selected_symptoms], bundle.symptom_index)[0])
+    
+    def predict_cached(self, records, return_bundle=False):
+        """Like predict_many, but answered from the prediction table or cache
+        where possible; only the misses are scored, in a single batch
+        
+        With return_bundle, returns (results, bundle) where bundle is the
+        ModelBundle that made the predictions, so that callers can label or
+        explain them with that model version even across a hot swap.
+        """
+        self.ensure_loaded()
+        bundle = self._bundle
+        results = self._predict_cached(bundle, records)
+        return (results, bundle) if return_bundle else results
+    
+    def _predict_cached(self, bundle, records):
+        if not bundle.is_ready:
+            return [(None, 0.0)] * len(records)
+        
+        start = time.perf_counter()
+        columns = symptom_columns(records, bundle.symptom_index)
+        masks = [columns_bitmask(cols) for cols in columns]
+        # The table holds full-ensemble answers; with the cascade enabled the
+        # cache is used instead, so single and batch predictions always agree
+        if bundle.prediction_table is not None and self.cascade_threshold is None:
+            results = [bundle.prediction_table.lookup(mask) for mask in masks]
+            source = 'table'
+        else:
+            results = [bundle.cache.get(mask) for mask in masks]
+            source = 'cache'
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='lookup')
+        
+        misses = [i for i, result in enumerate(results) if result is None]
+        if misses:
+            scored = self._predict_columns(bundle, [columns[i] for i in misses])
+            for i, result in zip(misses, scored):
+                results[i] = result
+                if result[0] is not None:
+                    bundle.cache.put(masks[i], result)
+            PREDICTIONS.inc(len(misses), source='models')
+        if len(misses) < len(records):
+            PREDICTIONS.inc(len(records) - len(misses), source=source)
+        return results
+    
+    def predict_many(self, records, return_stages=False, explain=False):
+        """Predict diseases for many symptom lists, running each model once
+        
+        With return_stages each result also names the cascade stage that
+        answered it (ENSEMBLE_STAGE when every model voted). With explain each
+        result ends with the record's (symptom, {model name: contribution})
+        pairs toward the predicted disease, in vocabulary order (see
+        _contributions); explained predictions always come from the full
+        ensemble.
+        """
+        self.ensure_loaded()
+        results = self._predict_records(self._bundle, records, return_stages, explain)
+        PREDICTIONS.inc(len(results), source='batch')
+        return results
+    
+    def predict_arrays(self, feature_array, return_stages=False, explain=False):
+        """Predict from a feature matrix, returning (diseases, confidences) arrays
+        
+        Both are None when no model could make a prediction. With
+        return_stages a third array names the stage that answered each row.
+        With explain the last item maps each explained model's name to a CSR
+        matrix of its contributions toward each row's disease, with an entry
+        for every set input cell.
+        """
+        bundle = self._bundle
+        if not explain:
+            diseases, confidences, stages = self._predict_arrays(bundle, feature_array)
+            return (diseases, confidences, stages) if return_stages else (diseases, confidences)
+        
+        diseases, confidences, stages, contributions = self._explained_arrays(bundle, feature_array)
+        if contributions is not None:
+            rows, cols, per_model = contributions
+            contributions = {model_name: sparse.csr_matrix((values, (rows, cols)), shape=feature_array.shape)
+                             for model_name, values in per_model.items()}
+        if return_stages:
+            return diseases, confidences, stages, contributions
+        return diseases, confidences, contributions
+    
+    def explain(self, selected_symptoms, disease, bundle=None):
+        """(symptom, {model name: contribution}) pairs toward disease for one symptom list
+        
+        Computed when asked for, off the scoring path: for predictions served from the table or cache, where no model ran;
+        pass the bundle that made the prediction to explain it with the same
+        models. Empty when nothing is loaded or no model can be explained.
+        """
+        self.ensure_loaded()
+        bundle = bundle or self._bundle
+        if not bundle.is_ready:
+            return []
+        feature_array = feature_matrix(symptom_columns([selected_symptoms], bundle.symptom_index),
+                                       len(bundle.symptoms))
+        contributions = self._contributions(bundle, feature_array, np.asarray([disease], dtype=object))
+        if contributions is None:
+            return []
+        return self._explanation_lists(bundle, 1, contributions)[0]
+    
+    def create_session(self, selected_symptoms=(), top_k=3):
+        """Start an interactive ScoringSession on the current linear models
+        
+        Returns None when no linear model is compiled (or nothing is loaded).
+        """
+        self.ensure_loaded()
+        bundle = self._bundle
+        if not bundle.is_ready or bundle.linear_engine is None:
+            return None
+        return ScoringSession(bundle.linear_engine, bundle.symptoms, bundle.symptom_index, bundle.version,
+                              selected_symptoms, top_k)
+    
+    def _predict_records(self, bundle, records, return_stages=False, explain=False):
+        if not bundle.is_ready:
+            return [self._empty_result(return_stages, explain)] * len(records)
+        return self._predict_columns(bundle, symptom_columns(records, bundle.symptom_index), return_stages, explain)
+    
+    @staticmethod
+    def _empty_result(return_stages, explain):
+        return (None, 0.0) + ((None,) if return_stages else ()) + (([],) if explain else ())
+    
+    def _predict_columns(self, bundle, columns, return_stages=False, explain=False):
+        """Score records given as validated column lists"""
+        if not columns:
+            return []
+        
+        start = time.perf_counter()
+        feature_array = feature_matrix(columns, len(bundle.symptoms))
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='features')
+        
+        if explain:
+            diseases, confidences, stages, contributions = self._explained_arrays(bundle, feature_array)
+        else:
+            diseases, confidences, stages = self._predict_arrays(bundle, feature_array)
+        if diseases is None:
+            return [self._empty_result(return_stages, explain)] * len(columns)
+        
+        fields = [diseases.tolist(), confidences.tolist()]
+        if return_stages:
+            fields.append(stages.tolist())
+        if explain:
+            fields.append(self._explanation_lists(bundle, len(columns), contributions)
+                          if contributions is not None else [[] for _ in columns])
+        return list(zip(*fields))
+    
+    def _explained_arrays(self, bundle, feature_array):
+        """Full-ensemble (diseases, confidences, stages, contributions)
+        
+        The flattened forests hand back the leaves they reached while
+        scoring, so the contributions need no second pass over the trees. The
+        cascade is not used: every model's contributions are needed.
+        """
+        if not bundle.is_ready:
+            return None, None, None, None
+        
+        leaves = {}
+        diseases, confidences = self._ensemble_arrays(bundle, feature_array, leaves)
+        if diseases is None:
+            return None, None, None, None
+        
+        start = time.perf_counter()
+        contributions = self._contributions(bundle, feature_array, diseases, leaves)
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='explain')
+        stages = np.full(feature_array.shape[0], ENSEMBLE_STAGE, dtype=object)
+        return diseases, confidences, stages, contributions
+    
+    def _contributions(self, bundle, feature_array, diseases, leaves=None):
+        """How much each set input cell pushed its row toward diseases[row]
+        
+        Returns (rows, cols, {model name: values}) over the nonzero cells,
+        or None when no model can be explained. The contributions are each
+        model's own, exact for the 0/1 rows feature_matrix builds: centered
+        weights for the compiled linear models (log-probability units) and
+        Saabas path contributions for flattened forests with binary splits
+        (probability units). Being in different units they are not combined
+        here; any scaling is for display.
+        """
+        n_rows = feature_array.shape[0]
+        if sparse.issparse(feature_array):
+            feature_array = feature_array.tocsr()
+            rows = np.repeat(np.arange(n_rows), np.diff(feature_array.indptr))
+            cols = feature_array.indices
+        else:
+            rows, cols = np.nonzero(feature_array)
+        classes, explain_linear, forests = bundle.explainers
+        targets = np.searchsorted(classes, diseases)
+        if not len(rows) or not np.array_equal(classes[np.minimum(targets, len(classes) - 1)], diseases):
+            return None
+        
+        per_model = {}
+        if explain_linear:
+            engine = bundle.linear_engine
+            per_model.update(zip(engine.names, engine.contributions(rows, cols, targets)))
+        for model_name in forests:
+            model = bundle.models[model_name]
+            forest_leaves = (leaves or {}).get(model_name)
+            if forest_leaves is None:
+                _, forest_leaves = model.predict_proba(feature_array, return_leaves=True)
+            per_model[model_name] = model.path_contributions(forest_leaves, targets, rows, cols)
+        
+        if not per_model:
+            return None
+        return rows, cols, per_model
+    
+    @staticmethod
+    def _explainers(bundle):
+        """Which of a bundle's models _contributions can explain
+        
+        Only models whose classes are the bundle's can share its class indices.
+        """
+        classes = np.asarray(bundle.classes)
+        engine = bundle.linear_engine
+        explain_linear = engine is not None and np.array_equal(engine.classes, classes)
+        forests = [model_name for model_name, model in bundle.models.items()
+                   if isinstance(model, FlatForest) and model.binary_splits
+                   and np.array_equal(model.classes_, classes)]
+        return classes, explain_linear, forests
+    
+    @staticmethod
+    def _explanation_lists(bundle, n_rows, contributions):
+        """Per row, (symptom, {model name: contribution}) pairs in vocabulary order"""
+        rows, cols, per_model = contributions
+        order = np.lexsort((cols, rows))
+        names = list(per_model)
+        values = np.column_stack([per_model[name][order] for name in names]).tolist()
+        explanations = [[] for _ in range(n_rows)]
+        symptoms = bundle.symptoms
+        for row, col, row_values in zip(rows[order].tolist(), cols[order].tolist(), values):
+            explanations[row].append((symptoms[col], dict(zip(names, row_values))))
+        return explanations
+    
+    def _predict_arrays(self, bundle, feature_array):
+        """(diseases, confidences, stages) from the cascade when it is enabled,
+        otherwise from every model"""
+        if not bundle.is_ready:
+            return None, None, None
+        
+        if self.cascade_threshold is not None and bundle.cascade:
+            return self._cascade_arrays(bundle, feature_array)
+        
+        diseases, confidences = self._ensemble_arrays(bundle, feature_array)
+        if diseases is None:
+            return None, None, None
+        return diseases, confidences, np.full(feature_array.shape[0], ENSEMBLE_STAGE, dtype=object)
+    
+    def _cascade_arrays(self, bundle, feature_array):
+        """Run the models cheapest first, settling each row at the first stage
+        whose running mean probability passes the threshold
+        
+        Rows no stage settles get the ordinary majority vote over all models,
+        so a threshold above 1 reproduces the full ensemble exactly.
+        """
+        n_rows = feature_array.shape[0]
+        best = np.zeros(n_rows, dtype=np.intp)
+        confidences = np.zeros(n_rows)
+        # Index into the cascade of the stage that answered; len(cascade) means the vote
+        answered_by = np.full(n_rows, len(bundle.cascade), dtype=np.intp)
+        
+        # Unsettled rows, their features and the probabilities scored for them so far
+        active = np.arange(n_rows)
+        remaining = feature_array
+        total = 0.0
+        scored = {}
+        for stage, (model_name, scorer) in enumerate(bundle.cascade):
+            start = time.perf_counter()
+            try:
+                proba = scorer(remaining)
+            except Exception as e:
+                MODEL_ERRORS.inc(model=model_name)
+                logger.exception(f"Error with model {model_name}: {e}")
+                continue
+            MODEL_SECONDS.observe(time.perf_counter() - start, model=model_name)
             
-            for model_file in model_files:
-                model_path = f"models/{model_file}"
-                if os.path.exists(model_path):
-                    model_name = model_file.replace('.joblib', '')
-                    self.models[model_name] = joblib.load(model_path)
+            scored[model_name] = proba
+            total = total + proba
+            if len(scored) == len(bundle.cascade):
+                break
             
-            if not self.models:
-                print("No models found. Training new models...")
-                from data_generator import train_models
-                train_models()
-                self.load_models()
+            mean = total / len(scored)
+            top = np.partition(mean, -2, axis=1)[:, -2:]
+            gate = top[:, 1] if self.cascade_metric == CONFIDENCE else top[:, 1] - top[:, 0]
+            done = gate >= self.cascade_threshold
+            if done.any():
+                rows = active[done]
+                best[rows] = mean[done].argmax(axis=1)
+                confidences[rows] = top[done, 1]
+                answered_by[rows] = stage
+                CASCADE_EXITS.inc(len(rows), stage=model_name)
                 
-        except Exception as e:
-            print(f"Error loading models: {e}")
-            # If models don't exist, train them
-            from data_generator import train_models
-            train_models()
-            self.load_models()
+                keep = ~done
+                active = active[keep]
+                if not active.size:
+                    break
+                remaining = remaining[keep]
+                total = total[keep]
+                scored = {name: proba[keep] for name, proba in scored.items()}
+        
+        if active.size:
+            if not scored:
+                return None, None, None
+            # Each model's own answer, in ensemble order so ties break as in _ensemble_arrays
+            probas = [scored[model_name] for model_name in bundle.models if model_name in scored]
+            start = time.perf_counter()
+            best[active], confidences[active] = self._majority_vote(
+                np.column_stack([proba.argmax(axis=1) for proba in probas]),
+                np.column_stack([proba.max(axis=1) for proba in probas]))
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage='vote')
+            CASCADE_EXITS.inc(len(active), stage=ENSEMBLE_STAGE)
+        
+        stage_names = np.array([model_name for model_name, _ in bundle.cascade] + [ENSEMBLE_STAGE], dtype=object)
+        return np.asarray(bundle.classes, dtype=object)[best], confidences, stage_names[answered_by]
     
-    def predict_disease(self, selected_symptoms):
-        """Predict disease based on selected symptoms"""
-        if not self.models or not self.symptoms:
-            return None, 0.0
+    def _ensemble_arrays(self, bundle, feature_array, leaves=None):
+        """(diseases, confidences) by majority vote of every model
         
-        # Create feature vector
-        feature_vector = [1 if symptom in selected_symptoms else 0 for symptom in self.symptoms]
-        feature_array = np.array(feature_vector).reshape(1, -1)
+        When a leaves dict is given, flattened forests also store the leaves
+        their trees reached in it by model name.
+        """
+        n_rows = feature_array.shape[0]
         
-        # Get predictions from all models
+        # Get predictions from all models, one call per model for the whole batch
         predictions = []
         confidences = []
+        compiled = self._compiled_probabilities(bundle, feature_array)
         
-        for model_name, model in self.models.items():
+        for model_name, model in bundle.models.items():
+            start = time.perf_counter()
             try:
-                pred = model.predict(feature_array)[0]
-                
                 # Get prediction probability/confidence
-                if hasattr(model, 'predict_proba'):
-                    proba = model.predict_proba(feature_array)[0]
-                    confidence = max(proba)
+                if model_name in compiled:
+                    proba = compiled[model_name]
+                    best = proba.argmax(axis=1)
+                    pred = bundle.linear_engine.classes[best]
+                    confidence = proba[np.arange(n_rows), best]
+                elif hasattr(model, 'predict_proba'):
+                    if leaves is not None and isinstance(model, FlatForest):
+                        proba, leaves[model_name] = model.predict_proba(feature_array, return_leaves=True)
+                    else:
+                        proba = model.predict_proba(feature_array)
+                    best = proba.argmax(axis=1)
+                    pred = model.classes_[best]
+                    confidence = proba[np.arange(n_rows), best]
                 else:
-                    confidence = 0.8  # Default confidence for models without probability
+                    pred = model.predict(feature_array)
+                    confidence = np.full(n_rows, 0.8)  # Default confidence for models without probability
                 
                 predictions.append(pred)
                 confidences.append(confidence)
+                MODEL_SECONDS.observe(time.perf_counter() - start, model=model_name)
                 
             except Exception as e:
-                print(f"Error with model {model_name}: {e}")
+                MODEL_ERRORS.inc(model=model_name)
+                logger.exception(f"Error with model {model_name}: {e}")
                 continue
         
         if not predictions:
-            return None, 0.0
+            return None, None
+        
+        start = time.perf_counter()
+        result = self._majority_vote(np.column_stack(predictions), np.column_stack(confidences))
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage='vote')
+        return result
+    
+    @staticmethod
+    def _compiled_probabilities(bundle, feature_array):
+        """Probabilities of every compiled linear model, keyed by model name"""
+        if bundle.linear_engine is None:
+            return {}
         
-        # Use majority voting or highest confidence prediction
-        if len(predictions) == 1:
-            return predictions[0], confidences[0]
+        start = time.perf_counter()
+        try:
+            proba = bundle.linear_engine.predict_proba(feature_array)
+        except Exception as e:
+            MODEL_ERRORS.inc(model='linear_engine')
+            logger.exception(f"Error with compiled linear models: {e}")
+            return {}
+        MODEL_SECONDS.observe(time.perf_counter() - start, model='linear_engine')
+        return dict(zip(bundle.linear_engine.names, proba))
+    
+    @staticmethod
+    def _majority_vote(predictions, confidences):
+        """Majority vote across models (columns), averaging the winners' confidences
         
-        # Find most common prediction
-        prediction_counts = Counter(predictions)
-        most_common_pred = prediction_counts.most_common(1)[0][0]
+        Ties go to the prediction of the earliest model, like Counter.most_common.
+        """
+        labels, codes = np.unique(predictions, return_inverse=True)
+        codes = codes.reshape(predictions.shape)
         
-        # Calculate average confidence for the most common prediction
-        avg_confidence = np.mean([conf for pred, conf in zip(predictions, confidences) 
-                                 if pred == most_common_pred])
+        # votes[i, j] = number of models agreeing with model j on row i
+        votes = (codes[:, :, None] == codes[:, None, :]).sum(axis=2)
+        winner = codes[np.arange(len(codes)), votes.argmax(axis=1)]
         
-        return most_common_pred, avg_confidence
+        agree = codes == winner[:, None]
+        avg_confidence = (confidences * agree).sum(axis=1) / agree.sum(axis=1)
+        return labels[winner], avg_confidence
     
     def get_disease_info(self, disease_name):
         """Get disease information, prevention tips, and treatment"""
@@ -268,4 +1010,5 @@ class DiseasePredictor:
     
     def get_available_symptoms(self):
         """Get list of available symptoms"""
+        self.ensure_loaded()
         return self.symptoms
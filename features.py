@@ -0,0 +1,87 @@
+import itertools
+
+import numpy as np
+from scipy import sparse
+
+# Vocabularies up to this size get dense 0/1 rows, which are cheaper to build
+# and score than CSR at that scale. Larger ones use CSR, so memory and time
+# follow the number of selected symptoms rather than the vocabulary size.
+MAX_DENSE_SYMPTOMS = 512
+
+
+class UnknownSymptomError(ValueError):
+    """Symptom names that are not in the loaded models' vocabulary"""
+
+    def __init__(self, unknown):
+        self.unknown = list(unknown)
+        super().__init__(f"Unknown symptoms: {', '.join(map(str, self.unknown))}")
+
+
+def symptom_columns(records, symptom_index):
+    """Sorted, de-duplicated column indices for each symptom list
+
+    Raises UnknownSymptomError naming every symptom missing from the index.
+    """
+    columns = []
+    unknown = []
+    for selected_symptoms in records:
+        cols = set()
+        for symptom in selected_symptoms:
+            col = symptom_index.get(symptom) if isinstance(symptom, str) else None
+            if col is None:
+                unknown.append(symptom)
+            else:
+                cols.add(col)
+        columns.append(sorted(cols))
+
+    if unknown:
+        raise UnknownSymptomError(dict.fromkeys(map(str, unknown)))
+    return columns
+
+
+def feature_matrix(columns, n_symptoms):
+    """0/1 feature rows from per-record column lists, dense or CSR by vocabulary size"""
+    counts = [len(cols) for cols in columns]
+    indices = np.fromiter(itertools.chain.from_iterable(columns), dtype=np.int32, count=sum(counts))
+
+    if n_symptoms > MAX_DENSE_SYMPTOMS:
+        indptr = np.zeros(len(columns) + 1, dtype=np.int64)
+        np.cumsum(counts, out=indptr[1:])
+        return sparse.csr_matrix((np.ones(len(indices)), indices, indptr), shape=(len(columns), n_symptoms))
+
+    feature_array = np.zeros((len(columns), n_symptoms), dtype=np.float64)
+    feature_array[np.repeat(np.arange(len(columns)), counts), indices] = 1
+    return feature_array
+
+
+def training_matrix(X):
+    """Model input for a dense 0/1 training chunk: CSR for large vocabularies"""
+    if X.shape[1] > MAX_DENSE_SYMPTOMS:
+        return sparse.csr_matrix(X, dtype=np.float64)
+    return X
+
+
+def stack_rows(blocks):
+    """Concatenate dense or CSR row blocks produced by training_matrix"""
+    if sparse.issparse(blocks[0]):
+        return sparse.vstack(blocks, format='csr')
+    return np.concatenate(blocks)
+
+
+def parity_probe(n_symptoms, n_random, seed=0):
+    """CSR rows for checking a compiled model against its sklearn original
+
+    No symptoms, every symptom alone, and n_random fixed random
+    selections. Memory grows with the vocabulary, not its square; the
+    random rows average at most 32 symptoms (half the vocabulary when
+    that is smaller).
+    """
+    rng = np.random.default_rng(seed)
+    density = min(0.5, 32 / n_symptoms)
+    random_rows = sparse.random(n_random, n_symptoms, density=density, format='csr', random_state=rng,
+                                data_rvs=np.ones)
+    return sparse.vstack([
+        sparse.csr_matrix((1, n_symptoms)),
+        sparse.identity(n_symptoms, format='csr'),
+        random_rows,
+    ], format='csr', dtype=np.float64)
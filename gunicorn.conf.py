@@ -0,0 +1,42 @@
+"""Gunicorn settings: load the models once and share them across workers
+
+gunicorn reads this file from the working directory automatically. With
+preload_app the app, and with it the model ensemble, is imported once in
+the master before the workers are forked, so every worker starts with the
+models already loaded and shares their memory copy-on-write. The model
+arrays themselves are memory-mapped read-only from the artifact files, so
+even a worker that loads its own copy (e.g. after a registry hot swap)
+shares them through the page cache.
+
+Set GUNICORN_PRELOAD=0 to have each worker load its own models instead.
+"""
+import gc
+import os
+import sys
+
+# --reload re-imports the app in each worker, which preloading would defeat
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0' and '--reload' not in sys.argv
+
+if preload_app:
+    # Finish loading in the master rather than in a warm-up thread, which
+    # would not survive the fork
+    os.environ.setdefault('PREDICTOR_STARTUP', 'eager')
+    # The master only loads; the registry watcher, micro-batcher and history
+    # writer start in each worker (post_fork). Running them in the master
+    # would load every published version a second time there, and workers
+    # re-forked later would inherit threads that may be mid-load.
+    os.environ['DEFER_BACKGROUND_THREADS'] = '1'
+
+
+def when_ready(server):
+    if preload_app:
+        # Move everything the master has loaded into the permanent generation:
+        # garbage collections in the workers then never write to those objects,
+        # which would copy the pages they live on into every worker
+        gc.freeze()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        import routes
+        routes.after_fork()
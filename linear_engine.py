@@ -0,0 +1,172 @@
+import logging
+
+import numpy as np
+from scipy import sparse
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from features import parity_probe
+
+logger = logging.getLogger(__name__)
+
+# Probability links applied to the raw linear scores of each model
+SOFTMAX = 'softmax'
+OVR = 'ovr'
+
+
+def linear_parameters(model):
+    """Return (weights, bias, link) for a linear scorer, or None if unsupported
+
+    weights has shape (n_features, n_classes) so that scores = X @ weights + bias.
+    """
+    if isinstance(model, MultinomialNB):
+        return model.feature_log_prob_.T, model.class_log_prior_, SOFTMAX
+
+    if isinstance(model, LogisticRegression) and len(model.classes_) > 2:
+        link = OVR if getattr(model, 'multi_class', 'auto') == 'ovr' else SOFTMAX
+        return model.coef_.T, model.intercept_, link
+
+    if isinstance(model, SGDClassifier) and model.loss == 'log_loss' and len(model.classes_) > 2:
+        return model.coef_.T, model.intercept_, OVR
+
+    return None
+
+
+def apply_link(scores, link):
+    """Turn raw per-class scores into probabilities along the last axis"""
+    if link == SOFTMAX:
+        scores = scores - scores.max(axis=-1, keepdims=True)
+        np.exp(scores, out=scores)
+    else:
+        # One-vs-rest logistic scores, normalised like sklearn's _predict_proba_lr
+        scores = 1.0 / (1.0 + np.exp(-scores))
+    scores /= scores.sum(axis=-1, keepdims=True)
+    return scores
+
+
+class LinearEnsemble:
+    """All linear models of the ensemble compiled into one stacked weight matrix
+
+    Scoring a batch is a single matmul for every compiled model at once, which
+    skips sklearn's per-call input validation and dispatch.
+    """
+
+    def __init__(self, names, classes, weights, bias, links):
+        self.names = list(names)
+        self.classes = np.asarray(classes)
+        self.n_classes = len(self.classes)
+        # (n_features, n_models * n_classes) and (n_models * n_classes,)
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64)
+        self.bias = np.ascontiguousarray(bias, dtype=np.float64)
+        self.links = list(links)
+        self._centered = None
+
+    @classmethod
+    def compile(cls, models, n_features):
+        """Compile every supported model in `models` (name -> estimator)
+
+        Returns None when no model can be compiled. Models whose classes differ
+        from the first compiled model, or that fail the parity check against
+        their own predict_proba, are left to the sklearn path.
+        """
+        names, weights, biases, links = [], [], [], []
+        classes = None
+
+        for name, model in models.items():
+            params = linear_parameters(model)
+            if params is None:
+                continue
+            if classes is None:
+                classes = model.classes_
+            elif not np.array_equal(classes, model.classes_):
+                logger.warning(f"Not compiling {name}: class labels differ from the other linear models")
+                continue
+
+            weight, bias, link = params
+            if weight.shape[0] != n_features:
+                logger.warning(f"Not compiling {name}: expected {n_features} features, got {weight.shape[0]}")
+                continue
+
+            names.append(name)
+            weights.append(weight)
+            biases.append(bias)
+            links.append(link)
+
+        if not names:
+            return None
+
+        engine = cls(names, classes, np.hstack(weights), np.concatenate(biases), links)
+        mismatched = engine.check_parity(models, n_features)
+        if mismatched:
+            logger.warning(f"Compiled scores differ from sklearn for {mismatched}, using sklearn for them")
+            keep = [i for i, name in enumerate(engine.names) if name not in mismatched]
+            if not keep:
+                return None
+            engine = engine._subset(keep)
+
+        return engine
+
+    def _subset(self, keep):
+        """Return an engine restricted to the models at positions `keep`"""
+        k = self.n_classes
+        cols = np.concatenate([np.arange(i * k, (i + 1) * k) for i in keep])
+        return LinearEnsemble([self.names[i] for i in keep], self.classes,
+                              self.weights[:, cols], self.bias[cols],
+                              [self.links[i] for i in keep])
+
+    def select(self, names):
+        """Return an engine scoring only the named models"""
+        return self._subset([self.names.index(name) for name in names])
+
+    def check_parity(self, models, n_features, atol=1e-9):
+        """Names of compiled models whose probabilities disagree with sklearn"""
+        probe = parity_probe(n_features, 64)
+        compiled = self.predict_proba(probe)
+        return [name for i, name in enumerate(self.names)
+                if not np.allclose(compiled[i], models[name].predict_proba(probe), atol=atol)]
+
+    @property
+    def centered_weights(self):
+        """Per-feature contribution to each class score, shape like weights
+
+        Softmax probabilities do not change when the same amount is added to
+        every class score, so each softmax model's weights are centered
+        across its classes; a feature's entry is then exactly what it adds to
+        that class's log-probability relative to the mean class. One-vs-rest
+        weights are used as they are (the class's own logit).
+        """
+        if self._centered is None:
+            k = self.n_classes
+            blocks = self.weights.reshape(self.weights.shape[0], len(self.names), k).copy()
+            for i, link in enumerate(self.links):
+                if link == SOFTMAX:
+                    blocks[:, i] -= blocks[:, i].mean(axis=1, keepdims=True)
+            self._centered = blocks.reshape(self.weights.shape)
+        return self._centered
+
+    def contributions(self, rows, cols, targets):
+        """Contribution of input cell (rows[i], cols[i]) toward class index targets[rows[i]]
+
+        For 0/1 inputs. Returns shape (n_models, len(rows)); a feature that is
+        absent contributes nothing, so only the set cells need scoring.
+        """
+        k = self.n_classes
+        offsets = np.arange(len(self.names)) * k
+        return self.centered_weights[cols[None, :], offsets[:, None] + targets[rows][None, :]]
+
+    def scores(self, X):
+        """Raw per-class scores with shape (n_samples, n_models, n_classes)"""
+        raw = X @ self.weights + self.bias
+        return raw.reshape(X.shape[0], len(self.names), self.n_classes)
+
+    def predict_proba(self, X):
+        """Class probabilities with shape (n_models, n_samples, n_classes)"""
+        X = X.astype(np.float64) if sparse.issparse(X) else np.asarray(X, dtype=np.float64)
+        scores = self.scores(X)
+        if all(link == SOFTMAX for link in self.links):
+            proba = apply_link(scores, SOFTMAX)
+        else:
+            proba = np.empty_like(scores)
+            for i, link in enumerate(self.links):
+                proba[:, i] = apply_link(scores[:, i], link)
+        return proba.transpose(1, 0, 2)
@@ -0,0 +1,170 @@
+"""Minimal in-process metrics with Prometheus text exposition.
+
+Counters and histograms are cheap enough to stay on permanently: one lock
+acquisition and a bisect per observation. Gauges are computed on scrape.
+
+Every value lives in the memory of the process that recorded it. Under a
+multi-worker gunicorn each scrape of /metrics reaches one worker, so every
+sample carries a `pid` label naming that worker: each worker's counters
+are then a series of their own that only ever grows, and rate() works per
+series. Aggregate across workers in the query, e.g.
+`sum without (pid) (rate(http_requests_total[5m]))`.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Seconds; tuned for sub-millisecond model calls up to slow page renders
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _register(metric):
+    with _registry_lock:
+        if any(existing.name == metric.name for existing in _registry):
+            raise ValueError(f"Metric {metric.name} is already registered")
+        _registry.append(metric)
+    return metric
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [*zip(labelnames, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels
+
+    By Prometheus convention counter names end in _total.
+    """
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self, extra=()):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}"
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, split by labels"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _register(self)
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall-clock seconds spent inside the with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self, extra=()):
+        with self._lock:
+            items = [(key, list(state)) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), state):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [*extra, ('le', _format_value(bound))])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, key, extra)
+            yield f"{self.name}_count{labels} {cumulative}"
+            yield f"{self.name}_sum{labels} {_format_value(state[-1])}"
+
+
+class Gauge:
+    """Value computed at scrape time by `collect`
+
+    `collect` returns a number, or a dict mapping label-value tuples to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, documentation, collect, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        _register(self)
+
+    def samples(self, extra=()):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}"
+
+
+def render():
+    """All registered metrics in the Prometheus text exposition format, labelled with this process's pid"""
+    with _registry_lock:
+        metrics = list(_registry)
+
+    # Read at scrape time: a forked worker has a different pid from its parent
+    worker = [('pid', os.getpid())]
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples(worker))
+    return '\n'.join(lines) + '\n'
+
+
+# Prometheus text format version served by /metrics
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timezone
+
+import joblib
+
+from tree_engine import compile_forest, is_forest
+
+REGISTRY_DIR = "models/registry"
+MANIFEST_FILE = "manifest.json"
+# Name of the file in REGISTRY_DIR holding the active version
+CURRENT_FILE = "CURRENT"
+
+
+class RegistryError(Exception):
+    """A model version is missing, incomplete or fails validation"""
+
+
+def file_sha256(path):
+    """Hex SHA-256 of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_atomic(path, text):
+    """Write text to path so readers see either the old or the new content"""
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def new_version_name():
+    """Sortable version name based on the current UTC time"""
+    return datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+
+
+def publish_version(trained_models, symptoms, metrics=None, registry_dir=REGISTRY_DIR,
+                    version=None, activate=True):
+    """Write models into a new registry version and optionally make it current
+
+    The version directory is assembled under a temporary name and renamed
+    into place, so watchers never see a half-written version.
+    """
+    version = version or new_version_name()
+    version_dir = os.path.join(registry_dir, version)
+    if os.path.exists(version_dir):
+        raise RegistryError(f"Model version {version} already exists")
+
+    tmp_dir = os.path.join(registry_dir, f".tmp-{version}")
+    os.makedirs(tmp_dir)
+    try:
+        models = {}
+        for name, model in trained_models.items():
+            file_name = f"{name}.joblib"
+            path = os.path.join(tmp_dir, file_name)
+            joblib.dump(model, path)
+            models[name] = {'file': file_name, 'sha256': file_sha256(path)}
+            if is_forest(model):
+                compile_forest(path, models[name]['sha256'], model)
+
+        manifest = {
+            'version': version,
+            'created': datetime.now(timezone.utc).isoformat(),
+            'symptoms': list(symptoms),
+            'models': models,
+            'metrics': metrics or {},
+        }
+        _write_atomic(os.path.join(tmp_dir, MANIFEST_FILE), json.dumps(manifest, indent=2))
+        os.rename(tmp_dir, version_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if activate:
+        activate_version(version, registry_dir)
+    print(f"Published model version {version} to {registry_dir}")
+    return version
+
+
+def activate_version(version, registry_dir=REGISTRY_DIR):
+    """Point CURRENT at an existing version; running predictors pick it up"""
+    read_manifest(os.path.join(registry_dir, version))
+    _write_atomic(os.path.join(registry_dir, CURRENT_FILE), version + '\n')
+
+
+def current_version(registry_dir=REGISTRY_DIR):
+    """The active version name, or None when there is no registry"""
+    try:
+        with open(os.path.join(registry_dir, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def list_versions(registry_dir=REGISTRY_DIR):
+    """All published version names, oldest first"""
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(name for name in os.listdir(registry_dir)
+                  if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE)))
+
+
+def read_manifest(version_dir):
+    """Load a version's manifest, raising RegistryError if it is absent or invalid"""
+    path = os.path.join(version_dir, MANIFEST_FILE)
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RegistryError(f"Cannot read manifest {path}: {e}") from e
+
+    for key in ('version', 'symptoms', 'models'):
+        if key not in manifest:
+            raise RegistryError(f"Manifest {path} has no '{key}'")
+    return manifest
+
+
+def verify_checksums(version_dir, manifest):
+    """Raise RegistryError unless every model file matches its manifest checksum"""
+    for name, entry in manifest['models'].items():
+        path = os.path.join(version_dir, entry['file'])
+        if not os.path.exists(path):
+            raise RegistryError(f"Model file {path} listed in the manifest is missing")
+        if file_sha256(path) != entry['sha256']:
+            raise RegistryError(f"Checksum mismatch for {name} in {version_dir}")
+
+
+def prune_versions(keep=5, registry_dir=REGISTRY_DIR):
+    """Delete all but the newest `keep` versions, never the current one"""
+    current = current_version(registry_dir)
+    versions = list_versions(registry_dir)
+    removed = []
+    for version in versions[:max(len(versions) - keep, 0)]:
+        if version != current:
+            shutil.rmtree(os.path.join(registry_dir, version))
+            removed.append(version)
+    return removed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect and manage the model registry")
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help="list versions, marking the current one")
+    activate = commands.add_parser('activate', help="make a version current (deploy or roll back)")
+    activate.add_argument('version')
+    prune = commands.add_parser('prune', help="delete old versions")
+    prune.add_argument('--keep', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        current = current_version(args.registry)
+        for version in list_versions(args.registry):
+            print(f"{'*' if version == current else ' '} {version}")
+    elif args.command == 'activate':
+        activate_version(args.version, args.registry)
+        print(f"Activated model version {args.version}")
+    else:
+        for version in prune_versions(args.keep, args.registry):
+            print(f"Removed model version {version}")
@@ -0,0 +1,234 @@
+"""Cross-validated model selection with an accuracy-vs-latency Pareto report
+
+Every hyperparameter combination in PARAM_GRIDS is scored with stratified
+k-fold cross-validation. The (candidate, fold) fits run in a forked process
+pool, and the fold matrices are sliced once up front and shared with the
+workers. Each candidate is then refitted on all the data and measured the
+way the predictor serves it: artifact size on disk, load time (mmap or the
+compiled forest), and predict latency for a single row and per row of a
+batch through the compiled engines.
+
+For each ensemble slot the report marks the Pareto front of CV accuracy
+against single-row latency. It picks the fastest front candidate whose
+accuracy is within --tolerance of the best, and --publish exports the picks
+as a new registry version.
+
+    python model_selection.py --samples 5000 --folds 5 --output selection.json --publish
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import accuracy_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+
+from benchmarks.timing import time_calls
+from data_generator import DISEASES, SYMPTOMS, build_models, generate_training_arrays
+from features import training_matrix
+from linear_engine import LinearEnsemble
+from model_registry import REGISTRY_DIR, file_sha256, publish_version
+from tree_engine import FlatForest, compile_forest, forest_path, is_forest, load_compiled_forest
+
+# Hyperparameters searched per ensemble slot; the other settings come from build_models
+PARAM_GRIDS = {
+    'random_forest': {'n_estimators': [25, 50, 100], 'max_depth': [None, 12, 8]},
+    'naive_bayes': {'alpha': [0.1, 0.5, 1.0]},
+    'logistic_regression': {'C': [0.1, 1.0, 10.0]},
+}
+
+# Candidates within this much CV accuracy of the best count as equally accurate
+ACCURACY_TOLERANCE = 0.005
+
+# Set before the pool forks so workers share them copy-on-write: the base
+# estimators, the full training data and the (X_train, y_train, X_test, y_test) folds
+_estimators = None
+_data = None
+_folds = None
+
+
+def cached_folds(X, y, n_folds=5, seed=42):
+    """Stratified k-fold splits, sliced once and reused by every candidate"""
+    splitter = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=seed)
+    return [(X[train], y[train], X[test], y[test]) for train, test in splitter.split(np.zeros(len(y)), y)]
+
+
+def _candidate(name, params):
+    return clone(_estimators[name]).set_params(**params)
+
+
+def _cv_task(name, params, fold):
+    X_train, y_train, X_test, y_test = _folds[fold]
+    model = _candidate(name, params).fit(X_train, y_train)
+    return accuracy_score(y_test, model.predict(X_test))
+
+
+def _fit_task(name, params):
+    X, y = _data
+    return _candidate(name, params).fit(X, y)
+
+
+def _run(fn, tasks, n_jobs):
+    """fn(*task) for every task, in a forked process pool when there is more than one core"""
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs <= 1:
+        return [fn(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('fork')) as pool:
+        futures = [pool.submit(fn, *task) for task in tasks]
+        return [future.result() for future in futures]
+
+
+def served_scorer(name, model, n_features):
+    """predict_proba of the engine the predictor serves this model with"""
+    if is_forest(model):
+        return FlatForest.from_estimator(model).predict_proba
+    engine = LinearEnsemble.compile({name: model}, n_features)
+    if engine is not None:
+        return lambda X: engine.predict_proba(X)[0]
+    return model.predict_proba
+
+
+def measure_costs(name, model, X, artifact_dir, repeat=300, batch_rows=1000):
+    """Artifact size, load time and single/batch latency of one fitted model"""
+    path = os.path.join(artifact_dir, f"{name}.joblib")
+    joblib.dump(model, path)
+    sha256 = file_sha256(path)
+    size = os.path.getsize(path)
+    if is_forest(model):
+        compile_forest(path, sha256, model)
+        size += os.path.getsize(forest_path(path))
+        load = lambda: load_compiled_forest(path, sha256)
+    else:
+        load = lambda: joblib.load(path, mmap_mode='r')
+
+    load_seconds = time_calls(load, 5, warmup=1).min()
+    scorer = served_scorer(name, model, X.shape[1])
+    rows = iter(X[np.arange(repeat + 10) % X.shape[0]][:, None, :])
+    single = time_calls(lambda: scorer(next(rows)), repeat, warmup=10)
+    batch = time_calls(lambda: scorer(X[:batch_rows]), 5, warmup=1)
+    return {
+        'size_kb': size / 1024,
+        'load_ms': load_seconds * 1000,
+        'single_us': float(np.median(single) * 1e6),
+        'batch_us_per_row': float(np.median(batch) * 1e6 / min(batch_rows, X.shape[0])),
+    }
+
+
+def pareto_front(candidates):
+    """Indices of candidates no other candidate beats on both accuracy and single latency"""
+    front = []
+    for i, a in enumerate(candidates):
+        dominated = any(
+            b['cv_accuracy'] >= a['cv_accuracy'] and b['single_us'] <= a['single_us']
+            and (b['cv_accuracy'] > a['cv_accuracy'] or b['single_us'] < a['single_us'])
+            for j, b in enumerate(candidates) if j != i)
+        if not dominated:
+            front.append(i)
+    return front
+
+
+def choose(candidates, tolerance=ACCURACY_TOLERANCE):
+    """Fastest Pareto candidate whose accuracy is within tolerance of the best"""
+    best = max(candidate['cv_accuracy'] for candidate in candidates)
+    eligible = [i for i, candidate in enumerate(candidates)
+                if candidate['pareto'] and candidate['cv_accuracy'] >= best - tolerance]
+    return min(eligible, key=lambda i: candidates[i]['single_us'])
+
+
+def select_models(n_samples=5000, n_folds=5, seed=None, grids=PARAM_GRIDS, tolerance=ACCURACY_TOLERANCE,
+                  n_jobs=-1):
+    """Cross-validate and measure every candidate
+
+    Returns (report, chosen) where report maps each model name to its
+    candidate rows and chosen maps it to the picked model, refitted on all
+    the data.
+    """
+    global _estimators, _data, _folds
+    X, y = generate_training_arrays(n_samples, seed)
+    X = training_matrix(X)
+    y = np.asarray(DISEASES)[y]
+    _estimators = build_models(n_jobs=1)
+    _data = (X, y)
+    _folds = cached_folds(X, y, n_folds)
+
+    tasks = [(name, params) for name, grid in grids.items() for params in ParameterGrid(grid)]
+    start = time.perf_counter()
+    scores = _run(_cv_task, [(name, params, fold) for name, params in tasks for fold in range(n_folds)], n_jobs)
+    fitted = _run(_fit_task, tasks, n_jobs)
+    print(f"Cross-validated {len(tasks)} candidates x {n_folds} folds in {time.perf_counter() - start:.1f}s")
+
+    report = {name: [] for name in grids}
+    models = {name: [] for name in grids}
+    probe = X[:1000]
+    probe = np.asarray(probe.toarray() if hasattr(probe, 'toarray') else probe, dtype=np.float64)
+    with tempfile.TemporaryDirectory() as artifact_dir:
+        for i, ((name, params), model) in enumerate(zip(tasks, fitted)):
+            fold_scores = scores[i * n_folds:(i + 1) * n_folds]
+            row = {'params': params, 'cv_accuracy': float(np.mean(fold_scores)),
+                   'cv_std': float(np.std(fold_scores))}
+            row.update(measure_costs(name, model, probe, artifact_dir))
+            report[name].append(row)
+            models[name].append(model)
+
+    chosen = {}
+    for name, candidates in report.items():
+        for candidate in candidates:
+            candidate['pareto'] = False
+            candidate['chosen'] = False
+        for i in pareto_front(candidates):
+            candidates[i]['pareto'] = True
+        pick = choose(candidates, tolerance)
+        candidates[pick]['chosen'] = True
+        chosen[name] = models[name][pick]
+
+    _estimators = _data = _folds = None
+    return report, chosen
+
+
+def print_selection(report):
+    """Per-model candidate table; * marks the Pareto front, > the pick"""
+    for name, candidates in report.items():
+        print(f"\n{name}")
+        print(f"    {'params':<38}{'cv accuracy':>16}{'size':>10}{'load':>9}{'single':>10}{'batch/row':>11}")
+        for candidate in sorted(candidates, key=lambda c: c['single_us']):
+            mark = ('>' if candidate['chosen'] else ' ') + ('*' if candidate['pareto'] else ' ')
+            params = ', '.join(f"{key}={value}" for key, value in candidate['params'].items())
+            print(f"  {mark}{params:<38}{candidate['cv_accuracy']:>9.3f} ±{candidate['cv_std']:.3f}"
+                  f"{candidate['size_kb']:>8.0f}KB{candidate['load_ms']:>7.1f}ms"
+                  f"{candidate['single_us']:>8.1f}us{candidate['batch_us_per_row']:>9.2f}us")
+
+
+def manifest_metrics(report):
+    """The picked candidates' settings and measurements, for the registry manifest"""
+    return {name: {key: value for key, value in candidate.items() if key not in ('pareto', 'chosen')}
+            for name, candidates in report.items() for candidate in candidates if candidate['chosen']}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cross-validate hyperparameter grids and report accuracy vs latency")
+    parser.add_argument('--samples', type=int, default=5000, help="number of rows to generate")
+    parser.add_argument('--folds', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--jobs', type=int, default=-1, help="worker processes (-1: one per core)")
+    parser.add_argument('--tolerance', type=float, default=ACCURACY_TOLERANCE,
+                        help="accuracy a faster candidate may give up against the best")
+    parser.add_argument('--output', help="also write the full report to this JSON file")
+    parser.add_argument('--publish', action='store_true', help="publish the picked models as a new registry version")
+    parser.add_argument('--registry', default=REGISTRY_DIR)
+    args = parser.parse_args()
+
+    report, chosen = select_models(args.samples, args.folds, args.seed, tolerance=args.tolerance, n_jobs=args.jobs)
+    print_selection(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.output}")
+    if args.publish:
+        publish_version(chosen, SYMPTOMS, manifest_metrics(report), args.registry)
@@ -0,0 +1,51 @@
+import hashlib
+from datetime import datetime, timezone
+
+from flask import make_response, request
+
+from prediction_cache import LRUCache
+
+
+class RenderedPage:
+    """A rendered HTML page with the validators for conditional requests"""
+
+    __slots__ = ('body', 'etag', 'last_modified')
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = hashlib.sha256(body.encode()).hexdigest()[:32]
+        self.last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    def response(self):
+        """Response carrying ETag/Last-Modified, answered with 304 when the client's copy is current"""
+        response = make_response(self.body)
+        response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        # Clients may keep the page but must revalidate it, since a new model
+        # version can change it at any time
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+class FragmentCache(LRUCache):
+    """Rendered template fragments for a small key set, each rendered once
+
+    get() renders and stores a fragment on its first miss; prerender()
+    fills the cache up front.
+    """
+
+    def __init__(self, render, maxsize=1024):
+        super().__init__(maxsize)
+        self.render = render
+
+    def prerender(self, keys):
+        """Render the fragments for keys up front, off the request path"""
+        for key in keys:
+            self.put(key, self.render(key))
+
+    def get(self, key):
+        fragment = super().get(key)
+        if fragment is None:
+            fragment = self.render(key)
+            self.put(key, fragment)
+        return fragment
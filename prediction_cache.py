@@ -0,0 +1,203 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+# One row per symptom combination: index into the disease list and confidence
+TABLE_DTYPE = np.dtype([('disease', np.uint8), ('confidence', np.float32)])
+
+# 2**24 rows * 5 bytes = 80MB; anything larger is served from the LRU cache only
+MAX_TABLE_SYMPTOMS = 24
+
+# Table file name inside the directory holding the models it was built from
+TABLE_FILE = "prediction_table.npy"
+
+# rows_bitmask packs a row into one int64
+MAX_BITMASK_SYMPTOMS = 63
+
+
+def columns_bitmask(columns):
+    """Encode a record's feature columns as an integer with bit i set for column i
+
+    Python ints are unbounded, so this works for any vocabulary size.
+    """
+    mask = 0
+    for col in columns:
+        mask |= 1 << col
+    return mask
+
+
+def bitmask_features(masks, n_symptoms):
+    """Expand an array of bitmasks into a 0/1 feature matrix"""
+    masks = np.asarray(masks, dtype=np.int64)
+    bits = np.arange(n_symptoms, dtype=np.int64)
+    return ((masks[:, None] >> bits) & 1).astype(np.float64)
+
+
+def rows_bitmask(feature_array):
+    """Bitmask of every row of a 0/1 feature matrix (dense or CSR), as int64
+
+    Only valid for up to MAX_BITMASK_SYMPTOMS symptoms.
+    """
+    bits = np.left_shift(1, np.arange(feature_array.shape[1], dtype=np.int64))
+    if sparse.issparse(feature_array):
+        return np.asarray(feature_array.astype(np.int64) @ bits).ravel()
+    return np.asarray(feature_array, dtype=np.int64) @ bits
+
+
+def model_fingerprint(paths):
+    """SHA-256 over the contents of the given artifact files"""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(os.path.basename(path).encode())
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class LRUCache:
+    """Bounded, thread-safe least-recently-used map with hit/miss counters
+
+    Holds predictions keyed by symptom bitmask for the predictor, and
+    rendered pages for the routes. None is never stored as a value, since
+    get() returns it for a miss.
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value cached for `key`, or None"""
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry if full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        """Drop all entries (e.g. after the models change)"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """Hit/miss counters and current size"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+class PredictionTable:
+    """Precomputed prediction for every symptom combination, memory-mapped
+
+    The table file is opened read-only with mmap, so every process serving
+    the same models shares a single copy through the page cache.
+    """
+
+    def __init__(self, table, diseases):
+        self.table = table
+        self.diseases = list(diseases)
+
+    @staticmethod
+    def metadata_path(path):
+        return os.path.splitext(path)[0] + '.json'
+
+    @classmethod
+    def load(cls, path, symptoms, fingerprint):
+        """Open a table, or return None if it is missing or was built for other models"""
+        meta_path = cls.metadata_path(path)
+        if not (os.path.exists(path) and os.path.exists(meta_path)):
+            return None
+
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('symptoms') != list(symptoms) or meta.get('fingerprint') != fingerprint:
+            logger.warning(f"Ignoring stale prediction table {path}")
+            return None
+
+        table = np.load(path, mmap_mode='r')
+        if table.dtype != TABLE_DTYPE or len(table) != 1 << len(symptoms):
+            logger.warning(f"Ignoring malformed prediction table {path}")
+            return None
+        return cls(table, meta['diseases'])
+
+    def lookup(self, mask):
+        """(disease, confidence) for a symptom bitmask"""
+        row = self.table[mask]
+        return self.diseases[row['disease']], float(row['confidence'])
+
+    def lookup_many(self, masks):
+        """(diseases, confidences) arrays for an array of symptom bitmasks"""
+        rows = self.table[masks]
+        return np.asarray(self.diseases, dtype=object)[rows['disease']], rows['confidence'].astype(np.float64)
+
+
+def build_prediction_table(predictor, path=None, chunk_size=1 << 16):
+    """Score every symptom combination with `predictor` and write the table
+
+    The table goes next to the predictor's current models unless `path` is given.
+    """
+    path = path or os.path.join(predictor.model_dir, TABLE_FILE)
+    symptoms = list(predictor.symptoms)
+    n_symptoms = len(symptoms)
+    if n_symptoms > MAX_TABLE_SYMPTOMS:
+        raise ValueError(f"{n_symptoms} symptoms is too many for a full table (max {MAX_TABLE_SYMPTOMS})")
+
+    diseases = None
+    size = 1 << n_symptoms
+    tmp_path = path + '.tmp'
+    table = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=TABLE_DTYPE, shape=(size,))
+
+    for start in range(0, size, chunk_size):
+        masks = np.arange(start, min(start + chunk_size, size))
+        labels, confidences = predictor.predict_arrays(bitmask_features(masks, n_symptoms))
+        if diseases is None:
+            diseases = sorted(predictor.classes)
+        table['disease'][start:start + len(masks)] = np.searchsorted(diseases, labels)
+        table['confidence'][start:start + len(masks)] = confidences
+
+    table.flush()
+    del table
+    os.replace(tmp_path, path)
+
+    meta = {'symptoms': symptoms, 'diseases': diseases, 'fingerprint': predictor.fingerprint}
+    with open(PredictionTable.metadata_path(path), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+    print(f"Prediction table with {size} entries written to {path}")
+    return path
+
+
+if __name__ == "__main__":
+    from disease_predictor import DiseasePredictor
+    build_prediction_table(DiseasePredictor(use_prediction_table=False))
@@ -0,0 +1,143 @@
+import logging
+import queue
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, inspect
+
+from app import db
+from batching import BatchWorker
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+HISTORY_ROWS = Counter('prediction_history_rows_total', "Prediction history rows, by outcome", ['outcome'])
+FLUSH_SECONDS = Histogram('prediction_history_flush_seconds', "Time spent writing one batch of history rows")
+FLUSH_SIZE = Histogram('prediction_history_flush_rows', "History rows written per batch insert",
+                       buckets=(1, 10, 50, 100, 250, 500, 1000, 2500))
+
+class PredictionRecord(db.Model):
+    """One served /predict call"""
+
+    __tablename__ = 'prediction_history'
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+    # Hex bitmask over the model version's symptom list (bit i = symptom i);
+    # unbounded text because large vocabularies fit neither a 64-bit integer
+    # nor a fixed-width string
+    symptom_mask = db.Column(db.Text, nullable=False)
+    disease = db.Column(db.String(100))
+    confidence = db.Column(db.Float, nullable=False)
+    model_version = db.Column(db.String(64))
+    latency_ms = db.Column(db.Float, nullable=False)
+
+
+def database_writer(app):
+    """Batch writer running one executemany INSERT per batch (multi-row VALUES on Postgres)
+
+    The table is created by the first write, in the writer thread, so a
+    worker starts without the database. While it is unreachable only the
+    history suffers: each batch fails and is counted, and creation is
+    retried with the next one.
+    """
+    created = False
+
+    def write(rows):
+        nonlocal created
+        with app.app_context():
+            if not created:
+                try:
+                    PredictionRecord.__table__.create(db.engine, checkfirst=True)
+                except Exception:
+                    # Another worker may have created it at the same moment
+                    if not inspect(db.engine).has_table(PredictionRecord.__tablename__):
+                        raise
+                created = True
+            db.session.execute(insert(PredictionRecord), rows)
+            db.session.commit()
+    return write
+
+
+class HistoryWriter:
+    """Write-behind buffer for prediction history
+
+    Request threads hand rows to record(), which only enqueues. A writer
+    thread drains the queue and writes batches of up to batch_size rows,
+    whenever a batch fills or flush_interval seconds after its first row.
+    While the database is slow the batches grow; once the bounded queue is
+    full record() waits at most max_wait seconds and then drops the row,
+    counting it, so the request path never stalls on the database.
+    """
+
+    def __init__(self, write_batch, max_queue=10000, batch_size=500, flush_interval=1.0, max_wait=0.0,
+                 start=True):
+        self.write_batch = write_batch
+        self.max_wait = max_wait
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._worker = BatchWorker(self._flush, 'history-writer', batch_size, flush_interval, max_queue,
+                                   start=start)
+
+    def start(self):
+        """Start the writer thread (see BatchWorker.start)"""
+        self._worker.start()
+
+    def record(self, symptom_mask, disease, confidence, model_version, latency_ms):
+        """Queue one prediction for writing; returns False if it had to be dropped"""
+        row = {
+            'created_at': datetime.now(timezone.utc),
+            'symptom_mask': format(symptom_mask, 'x'),
+            'disease': disease,
+            'confidence': float(confidence),
+            'model_version': model_version,
+            'latency_ms': float(latency_ms),
+        }
+        try:
+            self._worker.put(row, timeout=self.max_wait)
+        except queue.Full:
+            self._drop(1)
+            return False
+        return True
+
+    def close(self, timeout=10.0):
+        """Write what is already queued and stop the writer thread
+
+        Gives up after timeout seconds (e.g. when the database hangs at
+        shutdown); rows still queued then are discarded and counted as dropped.
+        """
+        left = self._worker.close(timeout)
+        if left:
+            logger.warning(f"Dropping {left} prediction history rows that were not written before shutdown")
+            self._drop(left)
+
+    def queue_depth(self):
+        return self._worker.queue_depth()
+
+    def stats(self):
+        """Queue depth and row counters"""
+        return {
+            'queue_depth': self.queue_depth(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+    def _drop(self, n):
+        self.dropped += n
+        HISTORY_ROWS.inc(n, outcome='dropped')
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        try:
+            self.write_batch(batch)
+        except Exception as e:
+            logger.exception(f"Error writing {len(batch)} prediction history rows: {e}")
+            self.failed += len(batch)
+            HISTORY_ROWS.inc(len(batch), outcome='failed')
+            return
+        FLUSH_SECONDS.observe(time.perf_counter() - start)
+        FLUSH_SIZE.observe(len(batch))
+        self.written += len(batch)
+        HISTORY_ROWS.inc(len(batch), outcome='written')
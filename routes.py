@@ -1,15 +1,142 @@
-from flask import render_template, request, flash, redirect, url_for
-from app import app
-from disease_predictor import DiseasePredictor
+from flask import render_template, request, flash, redirect, url_for, jsonify, g, session
+from markupsafe import Markup
+from app import app, db
+from batching import MicroBatcher
+from disease_predictor import DiseasePredictor, STAGE_SECONDS, UnknownSymptomError
+from page_cache import FragmentCache, RenderedPage
+from prediction_cache import LRUCache
+from prediction_history import HistoryWriter, database_writer
+from scoring_session import SessionStore
+import metrics
+import atexit
 import logging
+import os
+import time
 
-# Initialize disease predictor
-predictor = DiseasePredictor()
+# Initialize disease predictor. Models load in a warm-up thread by default so
+# importing this module (and booting a worker) never waits on artifacts;
+# PREDICTOR_STARTUP=eager|lazy selects the other startup modes.
+# PREDICT_CASCADE_THRESHOLD enables the early-exit model cascade; pick the
+# value with `python -m benchmarks cascade`.
+cascade_threshold = os.environ.get('PREDICT_CASCADE_THRESHOLD')
+predictor = DiseasePredictor(startup=os.environ.get('PREDICTOR_STARTUP', 'background'),
+                             cascade_threshold=float(cascade_threshold) if cascade_threshold else None,
+                             cascade_metric=os.environ.get('PREDICT_CASCADE_METRIC', 'confidence'))
+
+# A preloading gunicorn master sets DEFER_BACKGROUND_THREADS=1 (see
+# gunicorn.conf.py): it only loads the models, and the threads below start in
+# each worker from post_fork, so no worker is ever forked with live threads
+defer_threads = os.environ.get('DEFER_BACKGROUND_THREADS') == '1'
+
+# Upper bound on records accepted by a single batch request
+MAX_BATCH_RECORDS = 10000
+
+# With PREDICT_BATCH_WINDOW_MS set, concurrent /predict requests in this worker
+# are scored together in micro-batches (useful with threaded gunicorn workers)
+batch_window_ms = float(os.environ.get('PREDICT_BATCH_WINDOW_MS', '0'))
+batcher = None
+if batch_window_ms > 0:
+    batcher = MicroBatcher(predictor, int(os.environ.get('PREDICT_BATCH_MAX_SIZE', '64')), batch_window_ms,
+                           start=False)
+    metrics.Gauge('microbatch_queue_depth', "Requests waiting for the micro-batcher", batcher.queue_depth)
+
+# Live-scoring sessions for the symptom form, kept in this worker's memory
+sessions = SessionStore(int(os.environ.get('SCORING_SESSIONS_MAX', '10000')))
+metrics.Gauge('scoring_sessions', "Live-scoring sessions held by this worker", lambda: len(sessions))
+
+# Audit trail of /predict calls, written to the database in batches by a
+# background thread so the request path never waits on it; rows are dropped
+# (and counted) rather than blocking once the queue is full.
+# PREDICTION_HISTORY=0 turns it off.
+history = None
+if os.environ.get('PREDICTION_HISTORY', '1') != '0':
+    history = HistoryWriter(database_writer(app),
+                            max_queue=int(os.environ.get('PREDICTION_HISTORY_QUEUE_SIZE', '10000')),
+                            batch_size=int(os.environ.get('PREDICTION_HISTORY_BATCH_SIZE', '500')),
+                            flush_interval=float(os.environ.get('PREDICTION_HISTORY_FLUSH_SECONDS', '1')),
+                            start=False)
+    metrics.Gauge('prediction_history_queue_depth', "History rows waiting to be written", history.queue_depth)
+    atexit.register(history.close)
+
+# Rendered pages: the index once per symptom vocabulary (i.e. model version),
+# results pages by (model version, symptom bitmask, disease) in a bounded LRU,
+# and each disease's prevention/treatment fragment once per disease. Pages
+# that show flash messages are never cached.
+index_pages = LRUCache(4)
+results_pages = LRUCache(int(os.environ.get('RESULTS_PAGE_CACHE_SIZE', '2048')))
+disease_fragments = FragmentCache(
+    lambda disease: Markup(render_template('disease_info.html', disease_info=predictor.get_disease_info(disease))))
+with app.app_context():
+    disease_fragments.prerender(predictor.disease_info)
+metrics.Gauge('page_cache_hit_ratio', "Hit ratio of the rendered page and fragment caches",
+              lambda: {('index',): index_pages.stats()['hit_rate'],
+                       ('results',): results_pages.stats()['hit_rate'],
+                       ('disease_info',): disease_fragments.stats()['hit_rate']}, ['cache'])
+
+def start_background_threads():
+    """Start the registry watcher, micro-batcher and history writer in this process"""
+    # Hot-swap to newly published model versions without restarting workers
+    predictor.watch_registry(float(os.environ.get('MODEL_REGISTRY_POLL_SECONDS', '5')))
+    if batcher is not None:
+        batcher.start()
+    if history is not None:
+        history.start()
+
+def after_fork():
+    """Start this module's background threads in a gunicorn worker forked
+    from a preloading master (see gunicorn.conf.py)"""
+    predictor.after_fork()
+    # Database connections opened in the master must not be shared
+    with app.app_context():
+        db.engine.dispose(close=False)
+    start_background_threads()
+
+if not defer_threads:
+    start_background_threads()
+
+HTTP_REQUESTS = metrics.Counter('http_requests_total', "HTTP requests by endpoint and status", ['endpoint', 'status'])
+HTTP_SECONDS = metrics.Histogram('http_request_seconds', "HTTP request latency by endpoint", ['endpoint'])
+metrics.Gauge('predictor_cache_hit_ratio', "Hit ratio of the current model version's prediction cache",
+              lambda: predictor.cache.stats()['hit_rate'])
+metrics.Gauge('predictor_cache_entries', "Entries in the current model version's prediction cache",
+              lambda: predictor.cache.stats()['size'])
+metrics.Gauge('predictor_ready', "1 when predictions can be served", lambda: int(predictor.is_ready()))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.endpoint or 'unmatched'
+    start = g.get('request_start')
+    if start is not None:
+        HTTP_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint)
+    HTTP_REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
 
 @app.route('/')
 def index():
     """Main page with symptom selection form"""
-    symptoms = predictor.get_available_symptoms()
+    # Load the models first when starting lazily, so the check below sees
+    # them; the page and its cache key come from one bundle
+    predictor.ensure_loaded()
+    bundle = predictor.bundle
+    if not bundle.is_ready:
+        flash('The prediction models are still loading or unavailable. Please try again shortly.', 'warning')
+    
+    symptoms = bundle.symptoms
+    if '_flashes' in session:
+        return render_index(symptoms)
+    
+    key = (bundle.version, tuple(symptoms))
+    page = index_pages.get(key)
+    if page is None:
+        page = RenderedPage(render_index(symptoms))
+        index_pages.put(key, page)
+    return page.response()
+
+def render_index(symptoms):
     # Convert snake_case to readable format
     readable_symptoms = []
     for symptom in symptoms:
@@ -31,29 +158,158 @@ def predict():
         
         logging.debug(f"Selected symptoms: {selected_symptoms}")
         
-        # Predict disease
-        predicted_disease, confidence = predictor.predict_disease(selected_symptoms)
+        # Reject names outside the model vocabulary before they reach the batcher
+        predictor.validate_symptoms(selected_symptoms)
+        
+        # Predict disease; everything below uses the model bundle that made
+        # the prediction, never the current one, which a hot swap may replace
+        if batcher is not None:
+            (predicted_disease, confidence), bundle = batcher.predict(selected_symptoms, return_bundle=True)
+        else:
+            (predicted_disease, confidence), bundle = predictor.predict_disease(selected_symptoms,
+                                                                                return_bundle=True)
         
         if predicted_disease is None:
             flash('Unable to make a prediction. Please try again.', 'error')
             return redirect(url_for('index'))
         
-        # Get disease information
-        disease_info = predictor.get_disease_info(predicted_disease)
+        # The page depends only on the model version, the set of symptoms
+        # (listed in vocabulary order) and the prediction
+        mask = predictor.symptom_bitmask(selected_symptoms, bundle)
+        cacheable = '_flashes' not in session
+        key = (bundle.version, mask, predicted_disease)
+        html = results_pages.get(key) if cacheable else None
+        if html is None:
+            html = render_results(bundle, selected_symptoms, predicted_disease, confidence)
+            if cacheable:
+                results_pages.put(key, html)
         
-        # Convert selected symptoms to readable format
-        readable_selected = [symptom.replace('_', ' ').title() for symptom in selected_symptoms]
+        if history is not None:
+            history.record(mask, predicted_disease, confidence, bundle.version,
+                           (time.perf_counter() - g.request_start) * 1000)
+        return html
         
+    except UnknownSymptomError as e:
+        flash(f'{e}. Please choose from the listed symptoms.', 'error')
+        return redirect(url_for('index'))
+    except Exception as e:
+        logging.error(f"Error in prediction: {e}")
+        flash('An error occurred during prediction. Please try again.', 'error')
+        return redirect(url_for('index'))
+
+def render_results(bundle, selected_symptoms, predicted_disease, confidence):
+    # Get disease information
+    with STAGE_SECONDS.time(stage='disease_info'):
+        disease_info = predictor.get_disease_info(predicted_disease)
+        disease_info_html = disease_fragments.get(predicted_disease)
+    
+    # Each model's contribution of every selected symptom toward the
+    # prediction. Scored only here, so only for pages not already cached
+    with STAGE_SECONDS.time(stage='explain'):
+        explanation = [(symptom.replace('_', ' ').title(), contributions)
+                       for symptom, contributions in predictor.explain(selected_symptoms, predicted_disease, bundle)]
+    
+    # Convert selected symptoms to readable format
+    symptom_index = bundle.symptom_index
+    readable_selected = [symptom.replace('_', ' ').title()
+                         for symptom in sorted(set(selected_symptoms), key=symptom_index.__getitem__)]
+    
+    with STAGE_SECONDS.time(stage='render'):
         return render_template('results.html', 
                              predicted_disease=predicted_disease,
                              confidence=confidence,
                              selected_symptoms=readable_selected,
-                             disease_info=disease_info)
-        
+                             disease_info=disease_info,
+                             disease_info_html=disease_info_html,
+                             explanation=explanation)
+
+@app.route('/api/predict/batch', methods=['POST'])
+def predict_batch():
+    """Score many symptom lists in a single JSON request"""
+    payload = request.get_json(silent=True) or {}
+    records = payload.get('records')
+    
+    if not isinstance(records, list) or not all(isinstance(record, list) for record in records):
+        return jsonify({'error': 'Expected a JSON body of the form {"records": [[symptom, ...], ...]}'}), 400
+    
+    if len(records) > MAX_BATCH_RECORDS:
+        return jsonify({'error': f'At most {MAX_BATCH_RECORDS} records can be scored per request'}), 413
+    
+    # With the cascade enabled, say which stage answered each record
+    with_stages = predictor.cascade_threshold is not None
+    # "explain": true adds each record's per-symptom contributions, per model
+    explain = payload.get('explain') is True
+    try:
+        results = predictor.predict_many(records, return_stages=with_stages, explain=explain)
+    except UnknownSymptomError as e:
+        return jsonify({'error': str(e), 'unknown_symptoms': e.unknown}), 400
     except Exception as e:
-        logging.error(f"Error in prediction: {e}")
-        flash('An error occurred during prediction. Please try again.', 'error')
-        return redirect(url_for('index'))
+        logging.error(f"Error in batch prediction: {e}")
+        return jsonify({'error': 'An error occurred during prediction'}), 500
+    
+    predictions = []
+    for result in results:
+        prediction = {'disease': result[0], 'confidence': result[1]}
+        if with_stages:
+            prediction['stage'] = result[2]
+        if explain:
+            prediction['explanation'] = [{'symptom': symptom, 'contributions': contributions}
+                                         for symptom, contributions in result[-1]]
+        predictions.append(prediction)
+    return jsonify({'predictions': predictions})
+
+@app.route('/api/session', methods=['POST'])
+def create_session():
+    """Start a live-scoring session, optionally with symptoms already selected"""
+    payload = request.get_json(silent=True) or {}
+    selected_symptoms = payload.get('symptoms', [])
+    if not isinstance(selected_symptoms, list):
+        return jsonify({'error': 'Expected a JSON body of the form {"symptoms": [symptom, ...]}'}), 400
+    
+    try:
+        session = predictor.create_session(selected_symptoms)
+    except UnknownSymptomError as e:
+        return jsonify({'error': str(e), 'unknown_symptoms': e.unknown}), 400
+    if session is None:
+        return jsonify({'error': 'Live scoring is not available right now'}), 503
+    
+    return jsonify({'session': sessions.add(session), 'version': session.version,
+                    'selected': session.selected_symptoms(), 'top': session.top()}), 201
+
+@app.route('/api/session/<session_id>/toggle', methods=['POST'])
+def toggle_symptom(session_id):
+    """Add or remove one symptom and return the updated top-k with per-class changes"""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({'error': 'Unknown or expired session'}), 404
+    
+    payload = request.get_json(silent=True) or {}
+    symptom = payload.get('symptom')
+    present = payload.get('selected')
+    if not isinstance(symptom, str) or not isinstance(present, (bool, type(None))):
+        return jsonify({'error': 'Expected a JSON body of the form {"symptom": name, "selected": true|false}'}), 400
+    
+    try:
+        top = session.toggle(symptom, present)
+    except UnknownSymptomError as e:
+        return jsonify({'error': str(e), 'unknown_symptoms': e.unknown}), 400
+    return jsonify({'version': session.version, 'selected': session.selected_symptoms(), 'top': top})
+
+@app.route('/healthz')
+def healthz():
+    """Readiness probe: 200 once models are loaded, even if some are missing
+    
+    With lazy startup the probe itself triggers the load, so an orchestrator
+    that waits for readiness before sending traffic does not wait forever.
+    """
+    predictor.ensure_loaded()
+    readiness = predictor.readiness()
+    return jsonify(readiness), 200 if predictor.is_ready() else 503
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return metrics.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
 
 @app.route('/about')
 def about():
@@ -0,0 +1,121 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from features import symptom_columns
+from linear_engine import apply_link
+
+# Recompute the running scores from scratch every so many toggles so that
+# floating-point error from repeated add/subtract cannot accumulate
+REFRESH_EVERY = 256
+
+
+class ScoringSession:
+    """Running linear scores for one user's symptom selection
+
+    Holds the raw per-class scores of every compiled linear model. Toggling
+    a symptom adds or subtracts that feature's weight row, so an update is
+    O(models * classes) no matter how many symptoms are selected.
+    """
+
+    def __init__(self, engine, symptoms, symptom_index, version=None, selected_symptoms=(), top_k=3):
+        self.engine = engine
+        self.symptoms = symptoms
+        self.symptom_index = symptom_index
+        self.version = version
+        self.top_k = top_k
+        self.selected = set(symptom_columns([selected_symptoms], symptom_index)[0])
+        self.toggles = 0
+        self.last_used = time.monotonic()
+        self._lock = threading.Lock()
+        self._raw = self._rescore()
+        self._probabilities = self._average_probabilities()
+
+    def _rescore(self):
+        """Raw scores computed from the full selection"""
+        return self.engine.bias + self.engine.weights[sorted(self.selected)].sum(axis=0)
+
+    def _average_probabilities(self):
+        """Mean class probabilities over the linear models"""
+        scores = self._raw.reshape(len(self.engine.names), self.engine.n_classes)
+        return np.mean([apply_link(scores[i], link) for i, link in enumerate(self.engine.links)], axis=0)
+
+    def toggle(self, symptom, present=None):
+        """Add or remove one symptom (flip it when present is None) and return the top-k
+
+        Each entry carries the change in probability caused by this toggle.
+        """
+        col = symptom_columns([[symptom]], self.symptom_index)[0][0]
+        with self._lock:
+            self.last_used = time.monotonic()
+            present = col not in self.selected if present is None else bool(present)
+            if present != (col in self.selected):
+                if present:
+                    self.selected.add(col)
+                    self._raw += self.engine.weights[col]
+                else:
+                    self.selected.discard(col)
+                    self._raw -= self.engine.weights[col]
+                self.toggles += 1
+                if self.toggles % REFRESH_EVERY == 0:
+                    self._raw = self._rescore()
+
+            previous = self._probabilities
+            self._probabilities = self._average_probabilities()
+            return self._top(self._probabilities - previous)
+
+    def top(self):
+        """Current top-k without a change relative to a previous state"""
+        with self._lock:
+            return self._top(np.zeros_like(self._probabilities))
+
+    def _top(self, change):
+        proba = self._probabilities
+        best = np.argsort(-proba, kind='stable')[:self.top_k]
+        return [{'disease': str(self.engine.classes[i]),
+                 'probability': float(proba[i]),
+                 'change': float(change[i])} for i in best]
+
+    def selected_symptoms(self):
+        return [self.symptoms[col] for col in sorted(self.selected)]
+
+
+class SessionStore:
+    """Bounded in-process map of session id -> ScoringSession
+
+    Least recently used sessions are evicted beyond maxsize, and sessions
+    idle for longer than ttl seconds expire.
+    """
+
+    def __init__(self, maxsize=10000, ttl=1800):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, session):
+        """Store a session and return its new id"""
+        session_id = secrets.token_urlsafe(16)
+        with self._lock:
+            self._sessions[session_id] = session
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+        return session_id
+
+    def get(self, session_id):
+        """The live session for session_id, or None if it is unknown or expired"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            if time.monotonic() - session.last_used > self.ttl:
+                del self._sessions[session_id]
+                return None
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def __len__(self):
+        return len(self._sessions)
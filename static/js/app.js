@@ -39,10 +39,101 @@ function initializeSymptomForm() {
         checkbox.addEventListener('change', function() {
             updateSymptomCounter();
             highlightCheckedSymptom(this);
+            queueLiveToggle(form, this);
         });
     });
 }
 
+// Live estimate: a server-side scoring session updated one symptom at a time
+let liveSessionId = null;
+let liveQueue = Promise.resolve();
+
+function queueLiveToggle(form, checkbox) {
+    if (!document.getElementById('live-estimate')) return;
+    
+    // Send toggles one after another so the panel reflects the latest state
+    liveQueue = liveQueue.then(() => toggleLiveSymptom(form, checkbox)).catch(() => {
+        // The live estimate is best-effort; the form still works without it
+    });
+}
+
+async function startLiveSession(form) {
+    const symptoms = Array.from(form.querySelectorAll('input[name="symptoms"]:checked'), cb => cb.value);
+    const response = await fetch('/api/session', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json'},
+        body: JSON.stringify({symptoms: symptoms})
+    });
+    if (!response.ok) return null;
+    
+    const data = await response.json();
+    liveSessionId = data.session;
+    return data;
+}
+
+async function toggleLiveSymptom(form, checkbox) {
+    let data = null;
+    if (liveSessionId) {
+        const response = await fetch(`/api/session/${liveSessionId}/toggle`, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({symptom: checkbox.value, selected: checkbox.checked})
+        });
+        if (response.ok) {
+            data = await response.json();
+        } else if (response.status !== 404) {
+            return;
+        }
+    }
+    
+    // First toggle, or the session expired or lives in another worker
+    if (!data) {
+        data = await startLiveSession(form);
+    }
+    if (data) {
+        renderLiveEstimate(data);
+    }
+}
+
+function renderLiveEstimate(data) {
+    const panel = document.getElementById('live-estimate');
+    const list = document.getElementById('live-estimate-list');
+    if (!panel || !list) return;
+    
+    if (data.selected.length === 0) {
+        panel.classList.add('d-none');
+        return;
+    }
+    
+    list.replaceChildren(...data.top.map(entry => {
+        const item = document.createElement('li');
+        const change = formatConfidence(entry.change);
+        
+        const name = document.createElement('strong');
+        name.textContent = entry.disease;
+        item.appendChild(name);
+        item.append(` ${formatConfidence(entry.probability)}%`);
+        
+        if (change !== 0) {
+            const delta = document.createElement('span');
+            delta.className = `ms-2 small ${change > 0 ? 'text-success' : 'text-danger'}`;
+            delta.innerHTML = `<i class="fas fa-arrow-${change > 0 ? 'up' : 'down'} me-1"></i>`;
+            delta.append(`${Math.abs(change)}%`);
+            item.appendChild(delta);
+        }
+        return item;
+    }));
+    panel.classList.remove('d-none');
+}
+
+function resetLiveEstimate() {
+    liveSessionId = null;
+    const panel = document.getElementById('live-estimate');
+    if (panel) {
+        panel.classList.add('d-none');
+    }
+}
+
 function clearForm() {
     const form = document.getElementById('symptomForm');
     if (!form) return;
@@ -55,6 +146,7 @@ function clearForm() {
     });
     
     updateSymptomCounter();
+    resetLiveEstimate();
     showAlert('All symptoms cleared.', 'info');
 }
 
@@ -0,0 +1,66 @@
+import os
+
+# Importing app builds the routes module: keep it from loading models or
+# starting the history writer at import time
+os.environ.setdefault('PREDICTOR_STARTUP', 'lazy')
+os.environ.setdefault('PREDICTION_HISTORY', '0')
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.naive_bayes import MultinomialNB
+
+import disease_predictor
+from data_generator import DISEASES, generate_training_arrays, save_models
+from disease_predictor import DiseasePredictor
+
+
+@pytest.fixture(scope='session')
+def training_data():
+    """(X, y) with 0/1 float features and disease names"""
+    X, y = generate_training_arrays(1500, 0)
+    return X.astype(np.float64), np.asarray(DISEASES)[y]
+
+
+@pytest.fixture(scope='session')
+def test_rows():
+    """Unseen 0/1 rows, like the ones requests are scored on"""
+    return generate_training_arrays(200, 1)[0].astype(np.float64)
+
+
+@pytest.fixture(scope='session')
+def models(training_data):
+    """A small trained ensemble, named like the served one"""
+    X, y = training_data
+    return {
+        'random_forest': RandomForestClassifier(n_estimators=20, random_state=0).fit(X, y),
+        'naive_bayes': MultinomialNB().fit(X, y),
+        'logistic_regression': LogisticRegression(max_iter=1000, random_state=0).fit(X, y),
+    }
+
+
+@pytest.fixture(scope='session')
+def model_dir(models, tmp_path_factory):
+    """The ensemble saved as unversioned artifacts"""
+    model_dir = tmp_path_factory.mktemp('models')
+    save_models(models, str(model_dir))
+    return model_dir
+
+
+@pytest.fixture(scope='session')
+def make_predictor(model_dir, tmp_path_factory):
+    """Build DiseasePredictors on the saved ensemble, without a model registry"""
+    registry_dir = str(tmp_path_factory.mktemp('registry'))
+
+    def make(**kwargs):
+        kwargs.setdefault('use_prediction_table', False)
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(disease_predictor, 'MODEL_DIR', str(model_dir))
+            return DiseasePredictor(registry_dir=registry_dir, **kwargs)
+    return make
+
+
+@pytest.fixture(scope='session')
+def predictor(make_predictor):
+    return make_predictor()
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+class EchoPredictor:
+    """Stands in for DiseasePredictor.predict_cached, recording each batch"""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def predict_cached(self, records, return_bundle=False):
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append(list(records))
+        results = [(','.join(record), float(len(record))) for record in records]
+        return (results, 'bundle') if return_bundle else results
+
+
+def test_micro_batcher_coalesces_concurrent_requests():
+    gate = threading.Event()
+    predictor = EchoPredictor(gate)
+    batcher = MicroBatcher(predictor, max_batch_size=8, max_wait_ms=50)
+    results = {}
+
+    def request(i):
+        results[i] = batcher.predict([f's{i}'], timeout=5, return_bundle=True)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    # Requests pile up behind the first batch while it is held
+    assert wait_for(lambda: batcher.stats()['in_flight'] == 20)
+    gate.set()
+    for thread in threads:
+        thread.join()
+    batcher.close()
+
+    assert results == {i: ((f's{i}', 1.0), 'bundle') for i in range(20)}
+    assert sum(map(len, predictor.batches)) == 20
+    assert max(map(len, predictor.batches)) <= 8
+    assert len(predictor.batches) < 20
+    assert batcher.stats()['requests'] == 20
+
+
+def test_micro_batcher_reports_scoring_errors():
+    class Failing:
+        def predict_cached(self, records, return_bundle=False):
+            raise ValueError("boom")
+
+    batcher = MicroBatcher(Failing())
+    with pytest.raises(RuntimeError):
+        batcher.predict(['a'], timeout=5)
+    batcher.close()
+
+
+def test_micro_batcher_close_scores_what_is_queued_and_stops():
+    gate = threading.Event()
+    batcher = MicroBatcher(EchoPredictor(gate), max_batch_size=1)
+    results = []
+    threads = [threading.Thread(target=lambda i=i: results.append(batcher.predict([f's{i}'], timeout=5)))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+    assert wait_for(lambda: batcher.queue_depth() == 2)
+
+    closing = threading.Thread(target=batcher.close)
+    closing.start()
+    gate.set()
+    closing.join()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(results) == [('s0', 1.0), ('s1', 1.0), ('s2', 1.0)]
+    assert not batcher._worker._thread.is_alive()
@@ -0,0 +1,100 @@
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import bulk_score
+import disease_predictor
+from bulk_score import LISTS, bulk_score as run_bulk_score, chunk_payload, score_payload
+
+
+class CountingPredictor:
+    """A DiseasePredictor that records how many rows reach the models"""
+
+    def __init__(self, predictor):
+        self._predictor = predictor
+        self.rows_scored = 0
+
+    def __getattr__(self, name):
+        return getattr(self._predictor, name)
+
+    def predict_arrays(self, feature_array):
+        self.rows_scored += feature_array.shape[0]
+        return self._predictor.predict_arrays(feature_array)
+
+
+def expected(predictor, matrix):
+    diseases, confidences = predictor.predict_arrays(matrix.astype(np.float64))
+    return np.searchsorted(predictor.classes, diseases.astype(str)), confidences
+
+
+def test_repeated_rows_are_scored_once(predictor, test_rows):
+    matrix = test_rows[np.arange(300) % 25].astype(np.int8)
+    df = pd.DataFrame(matrix, columns=predictor.symptoms)
+    counting = CountingPredictor(predictor)
+
+    version, codes, confidences = score_payload(counting, chunk_payload(df, predictor.symptoms))
+
+    assert counting.rows_scored == len(np.unique(matrix, axis=0))
+    expected_codes, expected_confidences = expected(predictor, matrix)
+    assert version == predictor.version
+    np.testing.assert_array_equal(codes, expected_codes)
+    np.testing.assert_allclose(confidences, expected_confidences)
+
+
+def test_invalid_symptom_columns_are_left_unscored(predictor, test_rows):
+    matrix = test_rows[:6].astype(np.int8)
+    df = pd.DataFrame(matrix, columns=predictor.symptoms).astype(object)
+    symptom = predictor.symptoms[0]
+    df.loc[1, symptom] = 2
+    df.loc[3, symptom] = np.nan
+    df.loc[4, symptom] = 'yes'
+
+    _, codes, confidences = score_payload(predictor, chunk_payload(df, predictor.symptoms))
+
+    invalid = np.isin(np.arange(6), [1, 3, 4])
+    assert (codes[invalid] == -1).all() and (confidences[invalid] == 0).all()
+    expected_codes, expected_confidences = expected(predictor, matrix[~invalid])
+    np.testing.assert_array_equal(codes[~invalid], expected_codes)
+    np.testing.assert_allclose(confidences[~invalid], expected_confidences)
+
+
+def test_unknown_symptom_names_are_left_unscored(predictor):
+    first, second = predictor.symptoms[:2]
+    records = [[first], ['not_a_symptom'], f"{first}; {second}", None, [first, 'also_unknown']]
+
+    _, codes, confidences = score_payload(predictor, (LISTS, records))
+
+    assert list(codes[[1, 4]]) == [-1, -1] and list(confidences[[1, 4]]) == [0, 0]
+    assert (codes[[0, 2, 3]] >= 0).all()
+    assert codes[2] == score_payload(predictor, (LISTS, [[first, second]]))[1][0]
+
+
+def test_bulk_score_writes_rows_in_input_order(model_dir, predictor, test_rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(disease_predictor, 'MODEL_DIR', str(model_dir))
+    matrix = test_rows[:50].astype(np.int8)
+    df = pd.DataFrame(matrix, columns=predictor.symptoms)
+    df.insert(0, 'id', np.arange(50) * 10)
+    df.to_csv(tmp_path / 'intake.csv', index=False)
+
+    summary = run_bulk_score(str(tmp_path / 'intake.csv'), str(tmp_path / 'out.jsonl'), chunk_rows=16,
+                             workers=1, id_column='id', progress_seconds=1e9,
+                             registry_dir=str(tmp_path / 'registry'))
+
+    output = pd.read_json(tmp_path / 'out.jsonl', lines=True)
+    diseases, confidences = predictor.predict_arrays(matrix.astype(np.float64))
+    assert summary['rows'] == 50 and summary['unscored'] == 0
+    assert list(output['id']) == list(df['id'])
+    assert list(output['disease']) == list(diseases)
+    np.testing.assert_allclose(output['confidence'], confidences, atol=1e-6)
+
+
+def test_parquet_without_pyarrow_fails_before_loading_models(tmp_path, monkeypatch):
+    monkeypatch.setitem(sys.modules, 'pyarrow.parquet', None)
+    monkeypatch.setattr(bulk_score, 'DiseasePredictor', None)
+
+    with pytest.raises(RuntimeError, match=r"parquet extra"):
+        run_bulk_score(str(tmp_path / 'intake.parquet'), str(tmp_path / 'out.csv'))
+    with pytest.raises(RuntimeError, match=r"parquet extra"):
+        run_bulk_score(str(tmp_path / 'intake.csv'), str(tmp_path / 'out.parquet'))
@@ -0,0 +1,33 @@
+import time
+
+import numpy as np
+import pytest
+
+from data_generator import measure_fit, resident_memory_bytes
+
+pytestmark = pytest.mark.skipif(resident_memory_bytes() is None, reason="needs /proc/self/statm")
+
+
+def allocate(n_mb):
+    block = np.ones(n_mb * 1024 * 1024 // 8)
+    # Hold it for a few samples
+    time.sleep(0.05)
+    return block.sum()
+
+
+def test_measure_fit_reports_each_calls_own_peak():
+    # Run after a larger allocation: a process high-water mark would report 200MB for both
+    _, big = measure_fit(allocate, 200)
+    _, small = measure_fit(allocate, 50)
+
+    assert 190 <= big <= 230
+    assert 45 <= small <= 80
+
+
+def test_measure_fit_times_the_call_and_passes_arguments():
+    calls = []
+    seconds, peak_memory_mb = measure_fit(lambda *args, **kwargs: calls.append((args, kwargs)), 1, classes=[2])
+
+    assert calls == [((1,), {'classes': [2]})]
+    assert seconds >= 0
+    assert peak_memory_mb < 20
@@ -0,0 +1,133 @@
+import json
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from disease_predictor import ENSEMBLE_STAGE, DiseasePredictor
+from features import feature_matrix
+from prediction_cache import TABLE_DTYPE, TABLE_FILE, PredictionTable, rows_bitmask
+
+
+def test_explanations_are_each_models_raw_contributions(predictor):
+    bundle = predictor.bundle
+    symptoms = bundle.symptoms[:4]
+    disease = predictor.predict_disease(symptoms)[0]
+
+    explanation = predictor.explain(symptoms, disease)
+
+    columns = [bundle.symptom_index[symptom] for symptom in symptoms]
+    rows = np.zeros(len(columns), dtype=np.intp)
+    cols = np.asarray(columns)
+    target = np.searchsorted(bundle.classes, [disease])
+    engine = bundle.linear_engine
+    expected = dict(zip(engine.names, engine.contributions(rows, cols, target)))
+    forest = bundle.models['random_forest']
+    _, leaves = forest.predict_proba(feature_matrix([columns], len(bundle.symptoms)), return_leaves=True)
+    expected['random_forest'] = forest.path_contributions(leaves, target, rows, cols)
+
+    assert [symptom for symptom, _ in explanation] == symptoms
+    for i, (_, contributions) in enumerate(explanation):
+        assert set(contributions) == set(expected)
+        for model_name, values in expected.items():
+            assert contributions[model_name] == values[i]
+
+
+def test_batch_explanations_match_explain(predictor):
+    symptoms = predictor.bundle.symptoms
+    records = [symptoms[:3], symptoms[5:1:-1], [symptoms[-1]]]
+
+    for record, (disease, _, explanation) in zip(records, predictor.predict_many(records, explain=True)):
+        assert explanation == predictor.explain(record, disease)
+
+
+def test_results_page_explains_only_on_a_page_cache_miss(predictor, monkeypatch):
+    import routes
+
+    calls = []
+    explain = predictor.explain
+    monkeypatch.setattr(routes, 'predictor', predictor)
+    monkeypatch.setattr(predictor, 'explain', lambda *args: calls.append(args) or explain(*args))
+    routes.results_pages.clear()
+    client = routes.app.test_client()
+
+    for _ in range(3):
+        response = client.post('/predict', data={'symptoms': predictor.bundle.symptoms[:3]})
+        assert response.status_code == 200
+    assert len(calls) == 1
+
+
+def test_majority_vote_breaks_ties_like_most_common():
+    rng = np.random.default_rng(0)
+    # Few labels over few models, so there are plenty of ties
+    predictions = rng.choice(np.array(['a', 'b', 'c'], dtype=object), size=(500, 4))
+    confidences = rng.random((500, 4))
+
+    winners, averages = DiseasePredictor._majority_vote(predictions, confidences)
+
+    for row, winner, average in zip(range(len(predictions)), winners, averages):
+        expected = Counter(predictions[row].tolist()).most_common(1)[0][0]
+        assert winner == expected
+        assert average == pytest.approx(confidences[row][predictions[row] == expected].mean())
+
+
+def test_cascade_above_one_matches_the_full_ensemble(make_predictor, predictor, test_rows):
+    cascade = make_predictor(cascade_threshold=1.01)
+    assert cascade.bundle.cascade
+
+    diseases, confidences, stages = cascade.predict_arrays(test_rows, return_stages=True)
+    expected_diseases, expected_confidences, expected_stages = predictor.predict_arrays(test_rows,
+                                                                                        return_stages=True)
+
+    np.testing.assert_array_equal(diseases, expected_diseases)
+    np.testing.assert_allclose(confidences, expected_confidences, rtol=0, atol=1e-12)
+    assert set(stages) == set(expected_stages) == {ENSEMBLE_STAGE}
+
+
+@pytest.fixture
+def full_ensemble_table(predictor, model_dir, test_rows):
+    """A prediction table in model_dir holding full-ensemble answers for test_rows"""
+    masks = rows_bitmask(test_rows)
+    diseases = sorted(predictor.classes)
+    labels, confidences = predictor.predict_arrays(test_rows)
+    table = np.zeros(1 << test_rows.shape[1], dtype=TABLE_DTYPE)
+    table['disease'][masks] = np.searchsorted(diseases, labels)
+    table['confidence'][masks] = confidences
+
+    path = os.path.join(model_dir, TABLE_FILE)
+    np.save(path, table)
+    with open(PredictionTable.metadata_path(path), 'w') as f:
+        json.dump({'symptoms': predictor.symptoms, 'diseases': diseases,
+                   'fingerprint': predictor.bundle.fingerprint}, f)
+    yield path
+    os.remove(path)
+    os.remove(PredictionTable.metadata_path(path))
+
+
+def test_predict_page_and_batch_api_agree_with_the_cascade(make_predictor, predictor, test_rows,
+                                                          full_ensemble_table, monkeypatch):
+    import routes
+
+    cascade = make_predictor(cascade_threshold=0.5, use_prediction_table=True)
+    assert cascade.bundle.prediction_table is not None
+    records = [[cascade.symptoms[col] for col in np.flatnonzero(row)] for row in test_rows[:50]]
+    full = predictor.predict_many(records)
+    batch = [tuple(result[:2]) for result in cascade.predict_many(records)]
+    # Otherwise the test could not tell the table's answers from the cascade's
+    assert any(abs(a[1] - b[1]) > 1e-6 for a, b in zip(full, batch))
+
+    recorded = []
+    monkeypatch.setattr(routes, 'predictor', cascade)
+    monkeypatch.setattr(routes, 'history', SimpleNamespace(record=lambda *args: recorded.append(args[1:3])))
+    client = routes.app.test_client()
+    for record in records:
+        assert client.post('/predict', data={'symptoms': record}).status_code == 200
+    response = client.post('/api/predict/batch', json={'records': records})
+
+    api = [(prediction['disease'], prediction['confidence']) for prediction in response.get_json()['predictions']]
+    assert api == batch
+    assert [disease for disease, _ in recorded] == [disease for disease, _ in api]
+    np.testing.assert_allclose([confidence for _, confidence in recorded],
+                               [confidence for _, confidence in api], rtol=0, atol=1e-12)
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.ensemble import RandomForestClassifier
+from sklearn.naive_bayes import MultinomialNB
+
+from features import parity_probe
+from linear_engine import LinearEnsemble
+from tree_engine import FlatForest
+
+# Past MAX_DENSE_SYMPTOMS, so features are CSR
+N_SYMPTOMS = 3000
+
+
+@pytest.fixture(scope='module')
+def large_vocabulary_data():
+    rng = np.random.default_rng(0)
+    X = sparse.random(600, N_SYMPTOMS, density=0.005, format='csr', random_state=rng, data_rvs=np.ones)
+    y = rng.integers(3, size=600)
+    return X, y
+
+
+def test_parity_probe_is_sparse_and_covers_every_symptom():
+    probe = parity_probe(N_SYMPTOMS, 64)
+    assert sparse.issparse(probe)
+    assert probe.shape == (1 + N_SYMPTOMS + 64, N_SYMPTOMS)
+    assert probe[0].nnz == 0
+    assert (probe[1:N_SYMPTOMS + 1] != sparse.identity(N_SYMPTOMS)).nnz == 0
+    assert probe.nnz < 2 * N_SYMPTOMS + 64 * 64
+
+
+def test_parity_checks_on_a_large_vocabulary(large_vocabulary_data):
+    X, y = large_vocabulary_data
+    model = MultinomialNB().fit(X, y)
+    engine = LinearEnsemble.compile({'naive_bayes': model}, N_SYMPTOMS)
+    assert engine is not None and engine.check_parity({'naive_bayes': model}, N_SYMPTOMS) == []
+
+    forest = RandomForestClassifier(n_estimators=5, random_state=0).fit(X, y)
+    flat = FlatForest.from_estimator(forest)
+    assert flat.check_parity(forest)
+    # A compiled forest that no longer matches is caught
+    flat.value = flat.value[:, ::-1].copy()
+    assert not flat.check_parity(forest)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from sklearn.linear_model import SGDClassifier
+
+from linear_engine import LinearEnsemble
+
+
+@pytest.fixture(scope='module')
+def sgd_model(training_data):
+    X, y = training_data
+    return SGDClassifier(loss='log_loss', random_state=0).fit(X, y)
+
+
+@pytest.fixture(scope='module')
+def linear_models(models, sgd_model):
+    return {
+        'naive_bayes': models['naive_bayes'],
+        'logistic_regression': models['logistic_regression'],
+        'sgd': sgd_model,
+    }
+
+
+@pytest.mark.parametrize('name', ['naive_bayes', 'logistic_regression', 'sgd'])
+def test_compiled_model_matches_sklearn(linear_models, test_rows, name):
+    model = linear_models[name]
+    engine = LinearEnsemble.compile({name: model}, test_rows.shape[1])
+
+    assert engine.names == [name]
+    np.testing.assert_array_equal(engine.classes, model.classes_)
+    np.testing.assert_allclose(engine.predict_proba(test_rows)[0], model.predict_proba(test_rows),
+                               rtol=0, atol=1e-9)
+
+
+def test_stacked_models_match_sklearn_on_dense_and_csr(linear_models, test_rows):
+    engine = LinearEnsemble.compile(linear_models, test_rows.shape[1])
+
+    assert engine.names == list(linear_models)
+    for X in (test_rows, sparse.csr_matrix(test_rows)):
+        proba = engine.predict_proba(X)
+        for i, model in enumerate(linear_models.values()):
+            np.testing.assert_allclose(proba[i], model.predict_proba(test_rows), rtol=0, atol=1e-9)
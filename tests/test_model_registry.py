@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from data_generator import SYMPTOMS
+from disease_predictor import DiseasePredictor
+from model_registry import (RegistryError, activate_version, current_version, list_versions, publish_version,
+                            read_manifest, verify_checksums)
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+@pytest.fixture
+def registry(tmp_path):
+    return str(tmp_path / 'registry')
+
+
+@pytest.fixture
+def linear_models(models):
+    return {name: models[name] for name in ('naive_bayes', 'logistic_regression')}
+
+
+def test_publish_activate_and_roll_back(registry, linear_models):
+    assert current_version(registry) is None
+    first = publish_version(linear_models, SYMPTOMS, {'accuracy': 0.5}, registry, version='v1')
+    second = publish_version(linear_models, SYMPTOMS, registry_dir=registry, version='v2', activate=False)
+
+    assert list_versions(registry) == ['v1', 'v2']
+    assert current_version(registry) == first
+    activate_version(second, registry)
+    assert current_version(registry) == 'v2'
+    activate_version(first, registry)
+    assert current_version(registry) == 'v1'
+
+    with pytest.raises(RegistryError):
+        publish_version(linear_models, SYMPTOMS, registry_dir=registry, version='v1')
+    with pytest.raises(RegistryError):
+        activate_version('v3', registry)
+
+
+def test_tampered_artifacts_fail_the_checksum(registry, linear_models):
+    publish_version(linear_models, SYMPTOMS, registry_dir=registry, version='v1')
+    version_dir = f"{registry}/v1"
+    manifest = read_manifest(version_dir)
+    verify_checksums(version_dir, manifest)
+
+    with open(f"{version_dir}/naive_bayes.joblib", 'ab') as f:
+        f.write(b'tampered')
+    with pytest.raises(RegistryError, match="Checksum mismatch"):
+        verify_checksums(version_dir, manifest)
+
+
+def test_watcher_swaps_versions_and_keeps_serving_through_a_bad_one(registry, models, linear_models, test_rows):
+    publish_version(linear_models, SYMPTOMS, registry_dir=registry, version='v1')
+    predictor = DiseasePredictor(startup='eager', use_prediction_table=False, registry_dir=registry)
+    assert (predictor.version, sorted(predictor.bundle.models)) == ('v1', sorted(linear_models))
+    record = [symptom for symptom, present in zip(SYMPTOMS, test_rows[0]) if present]
+
+    predictor.watch_registry(0.01)
+    try:
+        # A new version is picked up without restarting
+        publish_version(models, SYMPTOMS, registry_dir=registry, version='v2')
+        assert wait_for(lambda: predictor.version == 'v2')
+        assert sorted(predictor.bundle.models) == sorted(models)
+        served = predictor.predict_disease(record)
+
+        # A corrupted version is rejected once and v2 keeps serving
+        publish_version(linear_models, SYMPTOMS, registry_dir=registry, version='v3', activate=False)
+        with open(f"{registry}/v3/logistic_regression.joblib", 'ab') as f:
+            f.write(b'tampered')
+        activate_version('v3', registry)
+        assert wait_for(lambda: predictor._rejected_version == 'v3')
+        time.sleep(0.05)
+        assert predictor.version == 'v2' and predictor.is_ready()
+        assert predictor.predict_disease(record) == served
+
+        # Rolling back swaps again
+        activate_version('v1', registry)
+        assert wait_for(lambda: predictor.version == 'v1')
+        assert predictor._rejected_version is None
+    finally:
+        predictor.stop_watching()
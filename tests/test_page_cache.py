@@ -0,0 +1,113 @@
+import pytest
+from flask import Flask
+
+from page_cache import FragmentCache, RenderedPage
+from prediction_cache import LRUCache
+
+
+def test_lru_cache_counts_hits_and_evicts_the_least_recently_used():
+    cache = LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'size': 2, 'maxsize': 2, 'hit_rate': 0.75}
+
+    cache.clear()
+    assert cache.get('a') is None and cache.stats()['size'] == 0
+
+
+def test_lru_cache_of_size_zero_stores_nothing():
+    cache = LRUCache(0)
+    cache.put('a', 1)
+    assert cache.get('a') is None
+
+
+def test_fragment_cache_renders_each_key_once_until_evicted():
+    rendered = []
+    fragments = FragmentCache(lambda key: rendered.append(key) or f'<p>{key}</p>', maxsize=2)
+    fragments.prerender(['flu', 'cold'])
+
+    assert fragments.get('flu') == '<p>flu</p>'
+    assert fragments.get('cold') == '<p>cold</p>'
+    assert rendered == ['flu', 'cold']
+
+    assert fragments.get('asthma') == '<p>asthma</p>'
+    # 'flu' was the least recently used, so it is rendered again
+    assert fragments.get('flu') == '<p>flu</p>'
+    assert rendered == ['flu', 'cold', 'asthma', 'flu']
+    assert fragments.stats()['hits'] == 2
+
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+
+def test_rendered_page_answers_revalidation_with_304(app):
+    page = RenderedPage('<html>page</html>')
+
+    with app.test_request_context():
+        response = page.response()
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == '<html>page</html>'
+    assert response.get_etag() == (page.etag, False)
+    assert response.cache_control.no_cache
+
+    with app.test_request_context(headers={'If-None-Match': f'"{page.etag}"'}):
+        assert page.response().status_code == 304
+    stale = RenderedPage('<html>new page</html>')
+    assert stale.etag != page.etag
+    with app.test_request_context(headers={'If-None-Match': f'"{page.etag}"'}):
+        assert stale.response().status_code == 200
+
+
+@pytest.fixture
+def client(predictor, monkeypatch):
+    import routes
+
+    monkeypatch.setattr(routes, 'predictor', predictor)
+    monkeypatch.setattr(routes, 'history', None)
+    routes.index_pages.clear()
+    routes.results_pages.clear()
+    return routes.app.test_client()
+
+
+def test_index_page_is_rendered_once_and_revalidated(client):
+    import routes
+
+    hits = routes.index_pages.stats()['hits']
+    first = client.get('/')
+    etag, _ = first.get_etag()
+    assert first.status_code == 200 and etag
+    assert client.get('/', headers={'If-None-Match': f'"{etag}"'}).status_code == 304
+    assert routes.index_pages.stats()['size'] == 1
+    assert routes.index_pages.stats()['hits'] == hits + 1
+
+
+def test_results_pages_are_cached_by_symptom_set(client, predictor):
+    import routes
+
+    symptoms = predictor.bundle.symptoms[:3]
+    hits = routes.results_pages.stats()['hits']
+    first = client.post('/predict', data={'symptoms': symptoms})
+    again = client.post('/predict', data={'symptoms': symptoms[::-1]})
+
+    assert first.status_code == again.status_code == 200
+    assert first.data == again.data
+    assert routes.results_pages.stats()['size'] == 1
+    assert routes.results_pages.stats()['hits'] == hits + 1
+
+
+def test_pages_with_flash_messages_bypass_the_cache(client, predictor):
+    import routes
+
+    with client.session_transaction() as session:
+        session['_flashes'] = [('info', 'hello')]
+    response = client.post('/predict', data={'symptoms': predictor.bundle.symptoms[:2]})
+
+    assert response.status_code == 200
+    assert routes.results_pages.stats()['size'] == 0
@@ -0,0 +1,111 @@
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy import select
+
+from app import db  # prediction_history needs the app's db first
+from prediction_history import HistoryWriter, PredictionRecord, database_writer
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+def record(writer, i):
+    return writer.record(i, 'Influenza', 0.5, 'v1', 1.0)
+
+
+def test_history_writer_flushes_in_batches_on_close():
+    batches = []
+    writer = HistoryWriter(batches.append, batch_size=4, flush_interval=0.05)
+    for i in range(10):
+        assert record(writer, i)
+    writer.close()
+
+    assert [row['symptom_mask'] for batch in batches for row in batch] == [format(i, 'x') for i in range(10)]
+    assert max(map(len, batches)) <= 4
+    assert writer.stats() == {'queue_depth': 0, 'written': 10, 'dropped': 0, 'failed': 0}
+
+
+def test_history_writer_flushes_after_the_interval():
+    batches = []
+    writer = HistoryWriter(batches.append, batch_size=100, flush_interval=0.05)
+    record(writer, 1)
+
+    assert wait_for(lambda: writer.written == 1)
+    assert len(batches) == 1
+    writer.close()
+
+
+def test_history_writer_drops_rows_when_the_queue_is_full():
+    batches = []
+    # Without a writer thread nothing drains the queue
+    writer = HistoryWriter(batches.append, max_queue=2, start=False)
+    assert record(writer, 1) and record(writer, 2)
+    assert not record(writer, 3)
+    assert writer.dropped == 1
+
+    # Rows nobody will write are dropped on close as well
+    writer.close()
+    assert writer.stats() == {'queue_depth': 0, 'written': 0, 'dropped': 3, 'failed': 0}
+    assert batches == []
+
+
+def test_history_writer_counts_failed_batches():
+    def write(rows):
+        raise ConnectionError("database is down")
+
+    writer = HistoryWriter(write, batch_size=10, flush_interval=0.01)
+    for i in range(3):
+        record(writer, i)
+    writer.close()
+
+    assert writer.failed == 3
+    assert writer.written == 0
+
+
+def test_history_writer_close_timeout_drops_what_is_left():
+    release = threading.Event()
+    batches = []
+
+    def write(rows):
+        release.wait()
+        batches.append(rows)
+
+    writer = HistoryWriter(write, batch_size=1, flush_interval=0.01)
+    record(writer, 0)
+    # The writer thread is now stuck on row 0
+    assert wait_for(lambda: writer.queue_depth() == 0)
+    for i in range(1, 4):
+        record(writer, i)
+
+    writer.close(timeout=0.1)
+    assert writer.dropped == 3
+
+    # Once unstuck the thread finishes row 0 and exits without the dropped rows
+    release.set()
+    writer._worker._thread.join(5)
+    assert not writer._worker._thread.is_alive()
+    assert writer.written == 1
+    assert [row['symptom_mask'] for batch in batches for row in batch] == ['0']
+
+
+def test_database_writer_creates_the_table_on_first_write(tmp_path):
+    history_app = Flask(__name__)
+    history_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'history.db'}"
+    db.init_app(history_app)
+    writer = HistoryWriter(database_writer(history_app), batch_size=2, flush_interval=0.01)
+    for i in range(3):
+        record(writer, i)
+    writer.close()
+
+    assert writer.written == 3
+    with history_app.app_context():
+        rows = db.session.execute(select(PredictionRecord.symptom_mask, PredictionRecord.disease)).all()
+    assert sorted(rows) == [('0', 'Influenza'), ('1', 'Influenza'), ('2', 'Influenza')]
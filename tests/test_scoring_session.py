@@ -0,0 +1,41 @@
+import numpy as np
+
+from features import feature_matrix
+from scoring_session import SessionStore
+
+
+def test_scoring_session_matches_a_full_recompute(predictor):
+    engine = predictor.bundle.linear_engine
+    symptoms = predictor.bundle.symptoms
+    session = predictor.create_session([symptoms[0]], top_k=len(engine.classes))
+    rng = np.random.default_rng(0)
+
+    for _ in range(300):
+        symptom = symptoms[rng.integers(len(symptoms))]
+        top = session.toggle(symptom)
+
+        selected = session.selected_symptoms()
+        columns = [[predictor.bundle.symptom_index[name] for name in selected]]
+        expected = engine.predict_proba(feature_matrix(columns, len(symptoms)))[:, 0].mean(axis=0)
+        got = {entry['disease']: entry['probability'] for entry in top}
+        np.testing.assert_allclose([got[str(disease)] for disease in engine.classes], expected,
+                                   rtol=0, atol=1e-9)
+
+
+def test_session_store_evicts_the_least_recently_used(predictor):
+    store = SessionStore(maxsize=2)
+    first, second, third = (store.add(predictor.create_session()) for _ in range(3))
+
+    assert store.get(first) is None
+    assert store.get(second) is not None and store.get(third) is not None
+    assert len(store) == 2
+
+
+def test_session_store_expires_idle_sessions(predictor):
+    store = SessionStore(ttl=60)
+    session = predictor.create_session()
+    session_id = store.add(session)
+    session.last_used -= 61
+
+    assert store.get(session_id) is None
+    assert len(store) == 0
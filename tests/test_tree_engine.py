@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from scipy import sparse
+
+from tree_engine import MATMUL_MIN_ROWS, FlatForest
+
+
+@pytest.fixture(scope='module')
+def forest(models):
+    return models['random_forest']
+
+
+@pytest.fixture(scope='module')
+def flat(forest):
+    return FlatForest.from_estimator(forest)
+
+
+@pytest.mark.parametrize('as_csr', [False, True])
+def test_predict_proba_matches_sklearn(forest, flat, test_rows, as_csr):
+    X = sparse.csr_matrix(test_rows) if as_csr else test_rows
+    np.testing.assert_allclose(flat.predict_proba(X), forest.predict_proba(test_rows), rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(flat.predict(X), forest.predict(test_rows))
+
+
+def test_leaves_are_the_same_for_dense_and_csr(flat, test_rows):
+    _, dense_leaves = flat.predict_proba(test_rows, return_leaves=True)
+    _, csr_leaves = flat.predict_proba(sparse.csr_matrix(test_rows), return_leaves=True)
+    np.testing.assert_array_equal(dense_leaves, csr_leaves)
+
+
+def saabas_reference(forest, x, target):
+    """Per-feature Saabas contributions of one row, walking each sklearn tree"""
+    contributions = np.zeros(len(x))
+    for estimator in forest.estimators_:
+        tree = estimator.tree_
+        value = tree.value[:, 0, :] / tree.value[:, 0, :].sum(axis=1, keepdims=True)
+        node = 0
+        while tree.children_left[node] != -1:
+            feature = tree.feature[node]
+            if x[feature] <= tree.threshold[node]:
+                node = tree.children_left[node]
+            else:
+                child = tree.children_right[node]
+                contributions[feature] += value[child, target] - value[node, target]
+                node = child
+    return contributions / len(forest.estimators_)
+
+
+@pytest.mark.parametrize('n_rows', [1, MATMUL_MIN_ROWS - 1, MATMUL_MIN_ROWS, 120])
+def test_path_contributions_match_saabas_walk(forest, flat, test_rows, n_rows):
+    X = test_rows[:n_rows]
+    proba, leaves = flat.predict_proba(X, return_leaves=True)
+    targets = proba.argmax(axis=1)
+    rows, cols = np.nonzero(X)
+
+    values = flat.path_contributions(leaves, targets, rows, cols)
+
+    expected = np.array([saabas_reference(forest, X[row], targets[row])[col] for row, col in zip(rows, cols)])
+    np.testing.assert_allclose(values, expected, rtol=0, atol=1e-12)
+
+
+def test_path_contributions_follow_the_cell_order(flat, test_rows):
+    X = test_rows[:40]
+    proba, leaves = flat.predict_proba(X, return_leaves=True)
+    targets = proba.argmax(axis=1)
+    rows, cols = np.nonzero(X)
+    order = np.random.default_rng(0).permutation(len(rows))
+
+    shuffled = flat.path_contributions(leaves, targets, rows[order], cols[order])
+
+    np.testing.assert_array_equal(shuffled, flat.path_contributions(leaves, targets, rows, cols)[order])
+    assert len(flat.path_contributions(leaves, targets, rows[:0], cols[:0])) == 0
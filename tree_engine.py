@@ -0,0 +1,324 @@
+import logging
+import os
+
+import joblib
+import numpy as np
+from scipy import sparse
+from sklearn.ensemble import ExtraTreesClassifier, RandomForestClassifier
+
+from features import parity_probe
+
+logger = logging.getLogger(__name__)
+
+# Suffix of the compiled forest saved next to a model's .joblib file. It
+# replaced .forest.npz, which is no longer read: versions that only have
+# one flatten their forest in memory at load
+FOREST_SUFFIX = '.forest.joblib'
+
+# Rows traversed at once; bounds the (rows, trees, classes) leaf-value gather
+CHUNK_ROWS = 2048
+
+# Batches from this many rows sum their path contributions with a sparse matmul
+MATMUL_MIN_ROWS = 16
+
+
+def is_forest(model):
+    """True for single-output tree ensembles FlatForest can compile"""
+    return (isinstance(model, (RandomForestClassifier, ExtraTreesClassifier))
+            and getattr(model, 'n_outputs_', 1) == 1)
+
+
+def forest_path(model_path):
+    """Where the compiled forest for `model_path` (a .joblib file) lives"""
+    root, ext = os.path.splitext(model_path)
+    return (root if ext == '.joblib' else model_path) + FOREST_SUFFIX
+
+
+class FlatForest:
+    """A tree ensemble flattened into contiguous node arrays
+
+    All trees share one node numbering; tree t starts at roots[t] and leaves
+    point to themselves. A batch is walked through all trees at once, one
+    level per step, with a few array gathers per level instead of a call
+    into each of the forest's trees. On 0/1 symptom inputs the threshold
+    comparison reduces to reading the input bit.
+
+    Exposes classes_, n_features_in_, predict_proba and predict so it can
+    stand in for the sklearn estimator in the ensemble.
+    """
+
+    def __init__(self, roots, children, feature, threshold, value, classes, n_features, source_sha256=''):
+        self.roots = roots
+        # children[2 * node] is the left and children[2 * node + 1] the right child
+        self.children = children
+        self.feature = feature
+        self.threshold = threshold
+        # Per-node class distribution, normalised like DecisionTreeClassifier.predict_proba
+        self.value = value
+        self.classes_ = np.asarray(classes)
+        self.n_features_in_ = int(n_features)
+        self.n_estimators = len(roots)
+        self.source_sha256 = str(source_sha256)
+
+        self.is_leaf = children[0::2] == np.arange(len(feature))
+        internal = ~self.is_leaf
+        self.binary_splits = bool(((threshold[internal] >= 0) & (threshold[internal] < 1)).all())
+        # Built by prepare_explanations, so forests that are never explained do not carry it
+        self._leaf_contributions = None
+
+    @classmethod
+    def from_estimator(cls, forest, source_sha256=''):
+        """Flatten a fitted RandomForestClassifier / ExtraTreesClassifier"""
+        if not is_forest(forest):
+            raise TypeError(f"Cannot flatten {type(forest).__name__}")
+
+        roots, children, features, thresholds, values = [], [], [], [], []
+        offset = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            nodes = np.arange(offset, offset + n_nodes, dtype=np.int32)
+            is_leaf = tree.children_left == -1
+
+            roots.append(offset)
+            left = np.where(is_leaf, nodes, tree.children_left + offset)
+            right = np.where(is_leaf, nodes, tree.children_right + offset)
+            children.append(np.stack([left, right], axis=1).ravel().astype(np.int32))
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+
+            value = tree.value[:, 0, :].astype(np.float64)
+            normalizer = value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(value / normalizer)
+
+            offset += n_nodes
+
+        return cls(np.asarray(roots, dtype=np.int32), np.concatenate(children), np.concatenate(features),
+                   np.concatenate(thresholds), np.concatenate(values), forest.classes_, forest.n_features_in_,
+                   source_sha256)
+
+    def save(self, path):
+        """Write the arrays uncompressed so that load() can memory-map them"""
+        tmp_path = path + '.tmp'
+        joblib.dump({'roots': self.roots, 'children': self.children, 'feature': self.feature,
+                     'threshold': self.threshold, 'value': self.value, 'classes': self.classes_.astype(str),
+                     'n_features': self.n_features_in_, 'source_sha256': self.source_sha256}, tmp_path)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """Open a saved forest with its arrays mapped read-only from the file
+
+        Every process serving the same file shares one copy of the node
+        arrays through the page cache.
+        """
+        data = joblib.load(path, mmap_mode='r')
+        # Plain ndarray views of the maps, so indexing results are ordinary arrays
+        arrays = [np.asarray(data[key]) for key in ('roots', 'children', 'feature', 'threshold', 'value')]
+        return cls(*arrays, data['classes'], data['n_features'], data['source_sha256'])
+
+    def leaves(self, X):
+        """Leaf node reached in every tree, shape (n_samples, n_estimators)"""
+        if not sparse.issparse(X):
+            X = np.asarray(X)
+        n_rows, n_features = X.shape
+        n_trees = self.n_estimators
+        cells = values = threshold = None
+        if sparse.issparse(X):
+            X = X.tocsr()
+            if self.binary_splits and (X.data == 1).all():
+                # A split goes right iff its (row, feature) cell is stored: look
+                # cells up among the sorted nonzero positions, never densifying
+                cells = np.sort(np.repeat(np.arange(n_rows, dtype=np.int64) * n_features, np.diff(X.indptr))
+                                + X.indices)
+                cells = np.append(cells, n_rows * n_features)
+            else:
+                X = X.toarray()
+        if cells is None:
+            if self.binary_splits and ((X == 0) | (X == 1)).all():
+                # Every split is "feature <= t" with 0 <= t < 1: a 0/1 input goes right iff it is 1
+                values = np.ascontiguousarray(X, dtype=np.uint8).ravel()
+            else:
+                # sklearn compares float32 inputs against float64 thresholds; do the same
+                values = np.ascontiguousarray(X, dtype=np.float32).ravel()
+                threshold = self.threshold
+
+        # One entry per (row, tree); only paths still at an internal node are advanced
+        node = np.tile(self.roots, n_rows)
+        row_offsets = np.repeat(np.arange(0, n_rows * n_features, n_features, dtype=np.int64), n_trees)
+        active = np.flatnonzero(~self.is_leaf[node])
+        current = node[active]
+        while active.size:
+            position = row_offsets[active] + self.feature[current]
+            if cells is not None:
+                go_right = cells[np.searchsorted(cells, position)] == position
+            elif threshold is None:
+                go_right = values[position]
+            else:
+                go_right = values[position] > threshold[current]
+            current = self.children[2 * current + go_right]
+            node[active] = current
+            internal = np.flatnonzero(~self.is_leaf[current])
+            active = active[internal]
+            current = current[internal]
+        return node.reshape(n_rows, n_trees)
+
+    def predict_proba(self, X, return_leaves=False):
+        """Mean of the trees' leaf class distributions, like the sklearn forest
+
+        With return_leaves, also the leaves reached (see leaves), which
+        path_contributions turns into explanations without another traversal.
+        """
+        if not sparse.issparse(X):
+            X = np.asarray(X)
+        n_rows = X.shape[0]
+        proba = np.empty((n_rows, len(self.classes_)))
+        leaves = np.empty((n_rows, self.n_estimators), dtype=self.children.dtype) if return_leaves else None
+        for start in range(0, n_rows, CHUNK_ROWS):
+            node = self.leaves(X[start:start + CHUNK_ROWS])
+            proba[start:start + CHUNK_ROWS] = self.value[node].sum(axis=1)
+            if return_leaves:
+                leaves[start:start + CHUNK_ROWS] = node
+        proba /= self.n_estimators
+        return (proba, leaves) if return_leaves else proba
+
+    def _build_turns(self):
+        """Per leaf, the splits on its root path that went right
+
+        Returns (leaf, split feature, child moved to) arrays, one entry per
+        turn. With binary splits a 0/1 row goes right exactly on the
+        features it has set, so these are the decisions a row reaching the
+        leaf made on its own symptoms.
+        """
+        n_nodes = len(self.feature)
+        internal = np.flatnonzero(~self.is_leaf)
+        parent = np.arange(n_nodes)
+        parent[self.children[2 * internal]] = internal
+        parent[self.children[2 * internal + 1]] = internal
+
+        # Walk every leaf up to its root at once, collecting the right turns
+        current = np.flatnonzero(self.is_leaf)
+        owner = current
+        turns = []
+        while current.size:
+            up = parent[current]
+            right = np.flatnonzero((up != current) & (self.children[2 * up + 1] == current))
+            turns.append((owner[right], self.feature[up[right]], current[right]))
+            moved = np.flatnonzero(up != current)
+            current, owner = up[moved], owner[moved]
+        leaves, features, nodes = (np.concatenate(parts) for parts in zip(*turns))
+        return leaves, features, nodes, parent
+
+    def prepare_explanations(self):
+        """Precompute every leaf's path contributions, if not done yet
+
+        Row class * n_nodes + leaf of the resulting CSR matrix holds, per
+        feature, what the right turns on that feature along the leaf's path
+        add to the class's probability, already divided by the number of
+        trees. Explaining a row is then a sum of one row per tree. This
+        takes a fraction of a second and a few times the memory of the
+        forest itself, so the predictor does it once when it loads a bundle.
+        """
+        if self._leaf_contributions is not None:
+            return
+        leaves, features, nodes, parent = self._build_turns()
+        n_nodes = len(self.feature)
+        n_classes = self.value.shape[1]
+        delta = (self.value[nodes] - self.value[parent[nodes]]) / self.n_estimators
+        # One block of rows per class; repeated (leaf, feature) turns are summed
+        rows = (np.arange(n_classes, dtype=np.int64)[:, None] * n_nodes + leaves).ravel()
+        self._leaf_contributions = sparse.csr_matrix(
+            (delta.T.ravel(), (rows, np.tile(features, n_classes))),
+            shape=(n_classes * n_nodes, self.n_features_in_))
+
+    def path_contributions(self, leaves, targets, rows, cols):
+        """Saabas contributions of set input cells (rows[i], cols[i]) toward class index targets[row]
+
+        leaves are the leaves reached by 0/1 rows, as from predict_proba.
+        Returns one value per cell, aligned with rows and cols: what the
+        splits on that feature added to the target class's probability,
+        averaged over the trees. Decisions on absent features are the
+        baseline and are left out, so only the cells a row has set can be
+        nonzero, and only those are aggregated. Only meaningful with
+        binary_splits.
+        """
+        self.prepare_explanations()
+        if not len(rows):
+            return np.zeros(0)
+        leaves = np.asarray(leaves)
+        n_rows, n_trees = leaves.shape
+        matrix = self._leaf_contributions
+        # Row i sums one precomputed row per tree, in its target class's block
+        picked = leaves + (np.asarray(targets, dtype=np.int64) * len(self.feature))[:, None]
+        if n_rows < MATMUL_MIN_ROWS:
+            # Gather the entries directly; scipy's fixed overhead dominates a few rows
+            starts = matrix.indptr[picked.ravel()]
+            counts = matrix.indptr[picked.ravel() + 1] - starts
+            entry = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+            entry += np.arange(len(entry))
+            row = np.repeat(np.arange(n_rows), counts.reshape(n_rows, -1).sum(axis=1))
+            col, data = matrix.indices[entry], matrix.data[entry]
+        else:
+            selector = sparse.csr_matrix((np.ones(picked.size), picked.ravel(),
+                                          np.arange(0, picked.size + 1, n_trees)),
+                                         shape=(n_rows, matrix.shape[0]))
+            sums = (selector @ matrix).tocoo()
+            row, col, data = sums.row, sums.col, sums.data
+
+        # Add the entries up per requested cell; any others are dropped
+        n_features = self.n_features_in_
+        wanted = np.asarray(rows, dtype=np.int64) * n_features + np.asarray(cols, dtype=np.int64)
+        order = np.argsort(wanted, kind='stable')
+        cells = row.astype(np.int64) * n_features + col
+        found = np.minimum(np.searchsorted(wanted, cells, sorter=order), len(wanted) - 1)
+        hit = wanted[order[found]] == cells
+        return np.bincount(order[found[hit]], weights=data[hit], minlength=len(wanted))
+
+    def predict(self, X):
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+    def check_parity(self, forest, atol=1e-12):
+        """True if predict_proba matches the sklearn forest on probe inputs"""
+        probe = parity_probe(self.n_features_in_, 256)
+        return np.allclose(self.predict_proba(probe), forest.predict_proba(probe), rtol=0, atol=atol)
+
+
+def compile_forest(model_path, sha256, forest=None):
+    """Flatten the forest saved at model_path and write it alongside; returns the path
+
+    `forest` skips reloading when the caller has just saved that estimator.
+    """
+    if forest is None:
+        forest = joblib.load(model_path)
+    flat = FlatForest.from_estimator(forest, sha256)
+    if not flat.check_parity(forest):
+        raise ValueError(f"Flattened forest does not match {model_path}")
+    path = forest_path(model_path)
+    flat.save(path)
+    return path
+
+
+def load_compiled_forest(model_path, sha256):
+    """The saved FlatForest for model_path if it was built from this exact file, else None"""
+    path = forest_path(model_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        flat = FlatForest.load(path)
+    except (OSError, ValueError, KeyError, EOFError) as e:
+        logger.warning(f"Ignoring unreadable compiled forest {path}: {e}")
+        return None
+    if flat.source_sha256 != sha256:
+        logger.warning(f"Ignoring stale compiled forest {path}")
+        return None
+    return flat
+
+
+if __name__ == "__main__":
+    import sys
+
+    from model_registry import file_sha256
+
+    for model_path in sys.argv[1:] or ["models/random_forest.joblib"]:
+        print(f"Compiled {model_path} -> {compile_forest(model_path, file_sha256(model_path))}")